@@ -0,0 +1,272 @@
+# analytics.py
+
+import math
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from skyblock_constants import BESTIARY_THRESHOLDS, SKILL_DATA
+from snapshot_store import SERIES_TABLES, absent_condition
+from tier_engine import COLLECTION_THRESHOLDS, FAMILIES, next_thresholds, resolve_family, threshold_matrix
+
+# Rates, moving averages and ETAs to the next skill level, collection tier or
+# bestiary milestone, for every series of a member at once.
+#
+# Nothing here keeps the history itself. Each (member, table) has a running
+# state: the latest value of every series, what it gained since tracking
+# began, and one exponentially weighted moving average (EWMA) of its rate per
+# half-life. An EWMA over irregular intervals decays by exp(-ln2 * dt / h),
+# so the weight of an interval only depends on how long ago it ended. That
+# lets a batch of new snapshots be folded in as one matrix product on top of
+# the decayed old state. The first request reads the history in chunks of
+# CHUNK_SNAPSHOTS snapshots, and every later one only reads the snapshots
+# committed since. A state is dropped and rebuilt when the database file is
+# replaced or migrated, or its history up to the folded snapshot changes
+# (a replay backfill).
+
+# EWMA label -> half-life in seconds
+HALF_LIVES = {'day': 86400, 'week': 7 * 86400}
+# The EWMA the ETAs are projected with.
+ETA_HALF_LIFE = os.getenv("ANALYTICS_ETA_HALF_LIFE", 'week')
+if ETA_HALF_LIFE not in HALF_LIVES:
+    print(f"Warning: ANALYTICS_ETA_HALF_LIFE must be one of {', '.join(HALF_LIVES)}, not {ETA_HALF_LIFE!r}; using 'week'.")
+    ETA_HALF_LIFE = 'week'
+CHUNK_SNAPSHOTS = 4096
+MAX_STATES = int(os.getenv("ANALYTICS_CACHE_STATES", 64)) # (member, kind) states kept per process
+
+# analytics kind -> (series table, value column)
+ANALYTICS_KINDS = {
+    'skills': ('skill_snapshots', 'total_xp'),
+    'slayers': ('slayer_snapshots', 'total_xp'),
+    'collections': ('collection_snapshots', 'amount'),
+    'bestiary': ('bestiary_snapshots', 'kills'),
+}
+
+def thresholds_for(kind, name):
+    """The ascending thresholds a series' tiers are counted against, or None."""
+    if kind == 'skills':
+        return SKILL_DATA.get(name, SKILL_DATA["standard"])
+    if kind == 'collections':
+        return COLLECTION_THRESHOLDS.get(name.upper())
+    if kind == 'bestiary':
+        # Bestiary series are the families (see family_columns()).
+        return BESTIARY_THRESHOLDS[FAMILIES[name][2]]
+    return None
+
+# --- Running state ---
+
+class SeriesRates:
+    """Running totals and rate EWMAs of one member's series in one table."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forgets everything folded so far."""
+        self.names = []
+        self.columns = {}
+        self.first_timestamp = None
+        self.timestamp = None # last folded snapshot
+        self.snapshots = 0 # folded so far
+        self.signature = None # database_signature() it was folded from
+        self.values = np.zeros(0)
+        self.gained = np.zeros(0) # sum of increases since the first snapshot
+        self.decayed = {label: np.zeros(0) for label in HALF_LIVES} # EWMA numerators
+        self.weight = {label: 0.0 for label in HALF_LIVES} # EWMA denominators
+        self.memo = None
+
+    def _column(self, name):
+        column = self.columns.get(name)
+        if column is None:
+            column = self.columns[name] = len(self.names)
+            self.names.append(name)
+        return column
+
+    def fold(self, timestamps, changes):
+        """Advances the state over new snapshots.
+
+        `timestamps` are the new snapshot timestamps, ascending, and `changes`
+        the (name, value, snapshot_timestamp) change rows among them. A series
+        first seen after the first snapshot counts from zero. Decreases (an API
+        toggled off) are not counted as progress.
+        """
+        if not len(timestamps):
+            return
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        self.snapshots += len(timestamps)
+        columns = np.fromiter((self._column(row[0]) for row in changes), dtype=np.intp, count=len(changes))
+        values = np.fromiter((row[1] or 0 for row in changes), dtype=np.float64, count=len(changes))
+        rows = np.searchsorted(timestamps, np.fromiter((row[2] for row in changes), dtype=np.int64, count=len(changes)))
+        width = len(self.names)
+        previous = np.zeros(width)
+        previous[:len(self.values)] = self.values
+
+        # Forward-fill the change rows over the snapshots, starting from the previous values.
+        grid = np.full((len(timestamps), width), np.nan)
+        grid[rows, columns] = values
+        source = np.where(np.isnan(grid), -1, np.arange(len(timestamps))[:, None])
+        np.maximum.accumulate(source, axis=0, out=source)
+        filled = np.where(source >= 0, grid[np.maximum(source, 0), np.arange(width)], previous)
+
+        if self.timestamp is None:
+            # The first snapshot is the baseline, not an increase.
+            self.first_timestamp, previous_timestamp, previous = int(timestamps[0]), timestamps[0], filled[0]
+            timestamps, filled = timestamps[1:], filled[1:]
+        else:
+            previous_timestamp = self.timestamp
+        self.timestamp = int(timestamps[-1]) if len(timestamps) else self.first_timestamp
+        self.memo = None
+        gained = np.pad(self.gained, (0, width - len(self.gained)))
+        if not len(timestamps):
+            self.values, self.gained = previous, gained
+            self.decayed = {label: np.pad(decayed, (0, width - len(decayed))) for label, decayed in self.decayed.items()}
+            return
+
+        increases = np.maximum(np.diff(np.vstack([previous, filled]), axis=0), 0)
+        elapsed = np.diff(np.concatenate([[previous_timestamp], timestamps])).astype(np.float64)
+        rates = increases / elapsed[:, None]
+        age = (self.timestamp - timestamps).astype(np.float64) # since each interval ended
+        for label, half_life in HALF_LIVES.items():
+            decay = math.log(2) / half_life
+            weights = -np.expm1(-decay * elapsed) * np.exp(-decay * age)
+            carried = math.exp(-decay * (self.timestamp - previous_timestamp))
+            self.decayed[label] = np.pad(self.decayed[label], (0, width - len(self.decayed[label]))) * carried + weights @ rates
+            self.weight[label] = self.weight[label] * carried + weights.sum()
+        self.values = filled[-1]
+        self.gained = gained + increases.sum(axis=0)
+
+    def ewma(self, label):
+        """Per-second rate EWMA of every series (zeros before the second snapshot)."""
+        weight = self.weight[label]
+        return self.decayed[label] / weight if weight else np.zeros(len(self.names))
+
+def refresh(conn, state, table, value_col, member):
+    """Folds every snapshot of `member` committed after `state.timestamp` into `state`.
+
+    Absence rows are skipped, so a series missing from a snapshot keeps its
+    last value instead of dropping to zero and counting its return as progress.
+    """
+    name_col = SERIES_TABLES[table][0]
+    while True:
+        after = state.timestamp if state.timestamp is not None else -1
+        snapshots = [row[0] for row in conn.execute('''
+            SELECT snapshot_timestamp FROM profile_snapshots
+            WHERE profile_id = ? AND member_uuid = ? AND snapshot_timestamp > ?
+            ORDER BY snapshot_timestamp ASC LIMIT ?
+        ''', (member[0], member[1], after, CHUNK_SNAPSHOTS))]
+        if not snapshots:
+            return
+        changes = conn.execute(f'''
+            SELECT {name_col}, {value_col}, snapshot_timestamp FROM {table}
+            WHERE profile_id = ? AND member_uuid = ? AND snapshot_timestamp BETWEEN ? AND ? AND NOT {absent_condition(table)}
+        ''', (member[0], member[1], snapshots[0], snapshots[-1])).fetchall()
+        state.fold(snapshots, changes)
+        if len(snapshots) < CHUNK_SNAPSHOTS:
+            return
+
+# --- Results ---
+
+def family_columns(names):
+    """Maps bestiary mob columns onto family indices (into FAMILIES); -1 for unmatched mobs."""
+    families = [resolve_family(name) for name in names]
+    return np.array([-1 if family is None else family for family in families], dtype=np.intp)
+
+def _per_family(family_of, array, count):
+    matched = family_of >= 0
+    totals = np.zeros(count)
+    np.add.at(totals, family_of[matched], array[matched])
+    return totals
+
+def _rounded(array, digits=3):
+    """Array -> list of floats, with inf/nan as None."""
+    return [None if not math.isfinite(value) else round(value, digits) for value in array.tolist()]
+
+def series_analytics(kind, state):
+    """Per-series rows of `state`, soonest ETA first. Memoized until the next fold."""
+    if state.memo is not None:
+        return state.memo
+    values, gained = state.values, state.gained
+    ewmas = {label: state.ewma(label) for label in HALF_LIVES}
+    names = list(state.names)
+    if kind == 'bestiary':
+        family_of = family_columns(names)
+        present = np.unique(family_of[family_of >= 0])
+        values, gained = (_per_family(family_of, array, len(FAMILIES))[present] for array in (values, gained))
+        ewmas = {label: _per_family(family_of, ewma, len(FAMILIES))[present] for label, ewma in ewmas.items()}
+        names = present.tolist()
+    thresholds = [thresholds_for(kind, name) for name in names]
+    tiers, next_values = next_thresholds(threshold_matrix(thresholds), values)
+    remaining = next_values - values
+    eta_rate = ewmas[ETA_HALF_LIFE]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        eta = np.where(eta_rate > 0, remaining / eta_rate, np.inf)
+    tracked = (state.timestamp - state.first_timestamp) if state.timestamp is not None else 0
+    rate = gained / tracked if tracked else np.zeros(len(names))
+
+    columns = {
+        'value': values.tolist(), 'tier': [tier if levels else None for tier, levels in zip(tiers.tolist(), thresholds)], 'next_threshold': _rounded(next_values),
+        'remaining': _rounded(remaining), 'rate_per_hour': _rounded(rate * 3600),
+        'eta_seconds': [None if seconds is None else int(seconds) for seconds in _rounded(eta, 0)],
+    }
+    ewma_columns = {label: _rounded(ewma * 3600) for label, ewma in ewmas.items()}
+    rows = []
+    for index, name in enumerate(names):
+        row = {"name": name}
+        if kind == 'bestiary':
+            island, mob_name, _ = FAMILIES[name]
+            row = {"name": mob_name, "island": island}
+        row.update({key: column[index] for key, column in columns.items()})
+        row["ewma_per_hour"] = {label: column[index] for label, column in ewma_columns.items()}
+        row["eta_timestamp"] = state.timestamp + row["eta_seconds"] if row["eta_seconds"] is not None else None
+        rows.append(row)
+    rows.sort(key=lambda row: (row["eta_seconds"] is None, row["eta_seconds"] or 0, row["name"]))
+    state.memo = rows
+    return rows
+
+def database_signature(conn, database_file):
+    """Changes when the file is replaced (new inode), migrated or backfilled by replay_archive.py."""
+    stat = os.stat(database_file)
+    try:
+        backfills = tuple(conn.execute('SELECT COUNT(*), TOTAL(replayed_through) FROM replay_progress').fetchone())
+    except sqlite3.OperationalError:
+        backfills = None # never backfilled
+    return (stat.st_dev, stat.st_ino, conn.execute('PRAGMA user_version').fetchone()[0], backfills)
+
+def history_matches(conn, state, member):
+    """Whether the member's snapshots up to `state.timestamp` are still the ones folded."""
+    row = conn.execute('SELECT COUNT(*), MIN(snapshot_timestamp) FROM profile_snapshots WHERE profile_id = ? AND member_uuid = ? AND snapshot_timestamp <= ?',
+                       (member[0], member[1], state.timestamp)).fetchone()
+    return (row[0], row[1]) == (state.snapshots, state.first_timestamp)
+
+class AnalyticsCache:
+    """SeriesRates per (database, member, kind), advanced on demand; the least
+    recently used states are dropped beyond `max_states`."""
+
+    def __init__(self, max_states=MAX_STATES):
+        self.max_states = max_states
+        self.states = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, conn, database_file, member, kind):
+        """Returns {"as_of", "tracked_since", "series"} for one member and kind."""
+        key = (database_file, member, kind)
+        signature = database_signature(conn, database_file)
+        with self.lock:
+            state = self.states.get(key)
+            if state is None:
+                state = self.states[key] = SeriesRates()
+                while len(self.states) > self.max_states:
+                    self.states.popitem(last=False)
+            else:
+                self.states.move_to_end(key)
+        with state.lock:
+            if state.timestamp is not None and (state.signature != signature or not history_matches(conn, state, member)):
+                # Never fold new snapshots onto totals from another history.
+                state.reset()
+            state.signature = signature
+            refresh(conn, state, *ANALYTICS_KINDS[kind], member)
+            return {"as_of": state.timestamp, "tracked_since": state.first_timestamp, "series": series_analytics(kind, state)}
@@ -1,42 +1,89 @@
 # app.py
 
-import sqlite3
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
 from datetime import datetime, timedelta, time
-import subprocess
-import sys
+import sqlite3
 from flask_cors import CORS
+from history import HISTORY_KINDS, ROLLUPS, choose_bucket, downsample, parse_downsample_args, read_history_rows, read_rollup, stream_history, to_columnar
+from snapshot_store import resolve_member, values_at
+from response_cache import ResponseCache, cached_response
+from db_pool import ReadOnlyPool
+from diff_engine import DIFF_KINDS, diff_rows, progress_by_bucket, progress_list, window_bounds
+from analytics import ANALYTICS_KINDS, ETA_HALF_LIFE, HALF_LIVES, AnalyticsCache
+import metrics
+from collect_scheduler import connect_jobs, job_status, seconds_until_next_run, trigger as trigger_collection
+from skyblock_constants import BESTIARY_THRESHOLDS
+from tier_engine import FAMILIES, bestiary_families, bestiary_tier
 
 app = Flask(__name__)
 CORS(app)
+metrics.instrument_app(app)
 
 DATABASE_FILE = 'skyblock_stats.db'
 
+response_cache = ResponseCache()
+# Read endpoints are cached until the collector commits the next snapshot.
+cached = cached_response(response_cache, lambda: DATABASE_FILE)
+
+read_pools = {}
+# Rates and ETAs are kept per member and advanced as snapshots arrive.
+analytics_cache = AnalyticsCache()
+
 def get_db_connection():
-    conn = sqlite3.connect(DATABASE_FILE)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Returns this thread's persistent read-only connection. Do not close it."""
+    pool = read_pools.get(DATABASE_FILE)
+    if pool is None:
+        pool = read_pools[DATABASE_FILE] = ReadOnlyPool(DATABASE_FILE)
+    return pool.get()
+
+@app.route('/metrics')
+def get_metrics():
+    """Prometheus scrape endpoint, summed over every worker and the collector."""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
 
 @app.route('/api/trigger_collect', methods=['POST'])
 def trigger_collect():
+    """Queues a collection run; concurrent triggers join the run in flight."""
     try:
-        subprocess.Popen([sys.executable, 'hypixel_tracker.py'])
-        return jsonify({"message": "Data collection started."}), 202
-    except Exception as e:
+        jobs = connect_jobs()
+        try:
+            job, outcome = trigger_collection(jobs)
+        finally:
+            jobs.close()
+    except (sqlite3.Error, OSError) as e:
         return jsonify({"error": str(e)}), 500
+    if outcome == 'throttled':
+        retry_after = seconds_until_next_run(job)
+        return jsonify({"message": f"Data was collected recently; try again in {retry_after}s.", "job_id": job['id'], "job": job}), 429, {'Retry-After': str(retry_after)}
+    message = "Data collection started." if outcome == 'queued' else "Data collection already in progress."
+    return jsonify({"message": message, "job_id": job['id'], "job": job}), 202
+
+@app.route('/api/collect_status/<int:job_id>')
+def get_collect_status(job_id):
+    jobs = connect_jobs(read_only=True)
+    try:
+        job = job_status(jobs, job_id)
+    finally:
+        jobs.close()
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
 
 @app.route('/api/latest_snapshot_timestamp')
+@cached
 def get_latest_snapshot_timestamp():
     conn = get_db_connection()
-    snap = conn.execute('SELECT snapshot_timestamp FROM profile_snapshots ORDER BY snapshot_timestamp DESC LIMIT 1').fetchone()
-    conn.close()
-    return jsonify({"latest_timestamp": snap['snapshot_timestamp'] if snap else None})
+    member = resolve_member(conn, request.args.get('member'))
+    return jsonify({"latest_timestamp": get_latest_member_timestamp(conn, member) if member else None})
 
 @app.route('/api/profile_stats/<int:timestamp>')
+@cached
 def get_profile_stats(timestamp):
     conn = get_db_connection()
-    stats = conn.execute('SELECT purse, death_count, kills, bank_balance FROM profile_snapshots WHERE snapshot_timestamp = ?', (timestamp,)).fetchone()
-    conn.close()
+    member = resolve_member(conn, request.args.get('member'))
+    stats = None
+    if member:
+        stats = conn.execute('SELECT purse, death_count, kills, bank_balance FROM profile_snapshots WHERE snapshot_timestamp = ? AND profile_id = ? AND member_uuid = ?', (timestamp,) + member).fetchone()
     if stats:
         return jsonify(dict(stats))
     return jsonify({"error": "Stats not found"}), 404
@@ -55,117 +102,237 @@ def get_start_timestamp(time_range='7d'):
         return 0
     return int(start_date.timestamp())
 
-@app.route('/api/history/skills')
-def get_skill_history():
-    time_range = request.args.get('range', '7d')
+HISTORY_DEFAULT_KEYS = {'profile_stats': ('total_money', 'kills', 'deaths')}
+
+def load_history(conn, member, kind, time_range, points=None, bucket=None):
+    """Reads one history kind for a member, honouring `points`/`bucket`.
+
+    Long ranges with a `points` budget are served from the hourly/daily rollups
+    instead of the raw snapshot tables; LTTB then trims each series to size.
+    """
     start_timestamp = get_start_timestamp(time_range)
+    history_data = {key: [] for key in HISTORY_DEFAULT_KEYS.get(kind, ())}
+    if member is None:
+        return history_data
+    if bucket is None and points:
+        bounds = conn.execute('SELECT MIN(snapshot_timestamp), MAX(snapshot_timestamp) FROM profile_snapshots WHERE profile_id = ? AND member_uuid = ? AND snapshot_timestamp >= ?', member + (start_timestamp,)).fetchone()
+        bucket = choose_bucket(bounds[0], bounds[1], points)
+    if bucket in ROLLUPS:
+        rows = read_rollup(conn, kind, member, bucket, start_timestamp)
+    else:
+        rows = read_history_rows(conn, kind, member, start_timestamp)
+
+    for name, value, snapshot_timestamp in rows:
+        if name not in history_data: history_data[name] = []
+        history_data[name].append({"timestamp": snapshot_timestamp, "value": value})
+    if points or isinstance(bucket, int):
+        history_data = downsample(history_data, points, bucket if isinstance(bucket, int) else None)
+    return history_data
+
+def history_response(kind):
+    """Serves /api/history/<kind>.
+
+    Raw (not downsampled) histories are streamed for `range=all` or `stream=1`
+    so a worker's memory does not grow with the history; `stream=0` opts out.
+    `format=columnar` returns {name: {"timestamps": [...], "values": [...]}}.
+    """
+    points, bucket = parse_downsample_args(request.args)
+    time_range = request.args.get('range', '7d')
+    columnar = request.args.get('format') == 'columnar'
     conn = get_db_connection()
-    rows = conn.execute('SELECT skill_name, total_xp, snapshot_timestamp FROM skill_snapshots WHERE snapshot_timestamp >= ? ORDER BY snapshot_timestamp ASC', (start_timestamp,)).fetchall()
-    conn.close()
-    history_data = {}
-    for row in rows:
-        key = row['skill_name']
-        if key not in history_data: history_data[key] = []
-        history_data[key].append({"timestamp": row['snapshot_timestamp'], "value": row['total_xp']})
-    return jsonify(history_data)
+    member = resolve_member(conn, request.args.get('member'))
+    stream = request.args.get('stream', '1' if time_range == 'all' else '0') not in ('0', 'false', '')
+    if stream and points is None and bucket is None:
+        return Response(stream_history(conn, kind, member, get_start_timestamp(time_range), columnar), mimetype='application/json')
+    history_data = load_history(conn, member, kind, time_range, points, bucket)
+    return jsonify(to_columnar(history_data) if columnar else history_data)
+
+@app.route('/api/history/skills')
+@cached
+def get_skill_history():
+    return history_response('skills')
 
 @app.route('/api/history/profile_stats')
+@cached
 def get_profile_stats_history():
-    time_range = request.args.get('range', '7d')
-    start_timestamp = get_start_timestamp(time_range)
-    conn = get_db_connection()
-    rows = conn.execute('SELECT purse, kills, death_count, bank_balance, snapshot_timestamp FROM profile_snapshots WHERE snapshot_timestamp >= ? ORDER BY snapshot_timestamp ASC', (start_timestamp,)).fetchall()
-    conn.close()
-    
-    history_data = {'total_money': [], 'kills': [], 'deaths': []}
-    for row in rows:
-        total_money = (row['purse'] or 0) + (row['bank_balance'] or 0)
-        history_data['total_money'].append({'timestamp': row['snapshot_timestamp'], 'value': total_money})
-        history_data['kills'].append({'timestamp': row['snapshot_timestamp'], 'value': row['kills']})
-        history_data['deaths'].append({'timestamp': row['snapshot_timestamp'], 'value': row['death_count']})
-        
-    return jsonify(history_data)
+    return history_response('profile_stats')
 
 @app.route('/api/history/collections')
+@cached
 def get_collection_history():
-    time_range = request.args.get('range', '7d')
-    start_timestamp = get_start_timestamp(time_range)
-    conn = get_db_connection()
-    rows = conn.execute('SELECT collection_name, amount, snapshot_timestamp FROM collection_snapshots WHERE snapshot_timestamp >= ? ORDER BY snapshot_timestamp ASC', (start_timestamp,)).fetchall()
-    conn.close()
-    history_data = {}
-    for row in rows:
-        key = row['collection_name']
-        if key not in history_data: history_data[key] = []
-        history_data[key].append({"timestamp": row['snapshot_timestamp'], "value": row['amount']})
-    return jsonify(history_data)
+    return history_response('collections')
 
 @app.route('/api/history/bestiary')
+@cached
 def get_bestiary_history():
-    time_range = request.args.get('range', '7d')
-    start_timestamp = get_start_timestamp(time_range)
+    return history_response('bestiary')
+
+def get_latest_member_timestamp(conn, member):
+    row = conn.execute('SELECT MAX(snapshot_timestamp) as end_ts FROM profile_snapshots WHERE profile_id = ? AND member_uuid = ?', member).fetchone()
+    return row['end_ts'] if row else None
+
+def get_progress_bounds(conn, member, time_range, end_ts=None):
+    """Returns (baseline, end) of a range preset, or None when there is nothing
+    to compare (see diff_engine.window_bounds)."""
+    return window_bounds(conn, member, get_start_timestamp(time_range), end_ts)
+
+def series_values_at(conn, table_name, val_col, member, timestamp):
+    """{name: value} of one series column as of `timestamp`."""
+    # Series tables only hold changes, so each value is read as of the snapshot.
+    return {name: values[0] for name, values in values_at(conn, table_name, member, timestamp, (val_col,)).items()}
+
+def load_diff(conn, member, kind, bounds, bucket_size=None):
+    """Progress of one diff kind over `bounds`: a list largest first, or per bucket."""
+    rows = diff_rows(conn, kind, member, *bounds, bucket_size) if bounds else []
+    if bucket_size is None:
+        return progress_list(kind, rows)
+    return {"from": bounds[0] if bounds else None, "to": bounds[1] if bounds else None, "bucket": bucket_size,
+            "series": progress_by_bucket(kind, rows)}
+
+@app.route('/api/diff/<kind>')
+@cached
+def get_diff(kind):
+    """Per-series progress of `skills`, `slayers`, `collections`, `bestiary` or `profile_stats`.
+
+    The window is `from`/`to` (Unix seconds, both optional; anything else is a
+    400) or a `range` preset (default `today`). Without `bucket` this returns [{"name", "progress",
+    "end_value"}], largest first; `bucket=hour|day|<seconds>` returns
+    {"from", "to", "bucket", "series": {name: [{"timestamp", "progress", "end_value"}]}}.
+    """
+    if kind not in DIFF_KINDS:
+        return jsonify({"error": "Unknown diff kind"}), 404
+    window = {}
+    for param in ('from', 'to'):
+        value = request.args.get(param)
+        try:
+            window[param] = int(value) if value is not None else None
+        except ValueError:
+            return jsonify({"error": f"'{param}' must be a Unix timestamp in seconds"}), 400
+    start_ts = window['from']
+    if start_ts is None:
+        start_ts = get_start_timestamp(request.args.get('range', 'today'))
+    _, bucket = parse_downsample_args(request.args)
     conn = get_db_connection()
-    rows = conn.execute(
-        'SELECT mob_id, kills, snapshot_timestamp FROM bestiary_snapshots WHERE snapshot_timestamp >= ? ORDER BY snapshot_timestamp ASC',
-        (start_timestamp,)
-    ).fetchall()
-    conn.close()
-
-    history_data = {}
-    for row in rows:
-        key = row['mob_id']
-        if key not in history_data:
-            history_data[key] = []
-        history_data[key].append({"timestamp": row['snapshot_timestamp'], "value": row['kills']})
-            
-    return jsonify(history_data)
-
-def get_progress_data(table_name, id_col, val_col, time_range):
-    start_boundary_ts = get_start_timestamp(time_range)
+    member = resolve_member(conn, request.args.get('member'))
+    bounds = window_bounds(conn, member, start_ts, window['to']) if member else None
+    return jsonify(load_diff(conn, member, kind, bounds, ROLLUPS[bucket][1] if bucket in ROLLUPS else bucket))
+
+def load_analytics(conn, member, kind):
+    if member is None:
+        return {"as_of": None, "tracked_since": None, "series": []}
+    return analytics_cache.get(conn, DATABASE_FILE, member, kind)
+
+@app.route('/api/analytics/<kind>')
+@cached
+def get_analytics(kind):
+    """Rates, EWMAs and the ETA to the next level/tier of every `skills`,
+    `slayers`, `collections` or `bestiary` (family) series.
+
+    Returns {"as_of", "tracked_since", "half_lives", "eta_half_life", "series":
+    [{"name", "value", "tier", "next_threshold", "remaining", "rate_per_hour",
+    "ewma_per_hour": {label: rate}, "eta_seconds", "eta_timestamp"}]}, soonest
+    ETA first. `rate_per_hour` averages over everything tracked; ETAs project
+    the `eta_half_life` EWMA from `as_of`.
+    """
+    if kind not in ANALYTICS_KINDS:
+        return jsonify({"error": "Unknown analytics kind"}), 404
     conn = get_db_connection()
-    latest_snapshot_query = conn.execute(f'SELECT MAX(snapshot_timestamp) as end_ts FROM {table_name}').fetchone()
-    end_ts = latest_snapshot_query['end_ts'] if latest_snapshot_query and latest_snapshot_query['end_ts'] is not None else None
-    
-    previous_snapshot_query = conn.execute(
-        f'SELECT MAX(snapshot_timestamp) as start_ts FROM {table_name} WHERE snapshot_timestamp < ?',
-        (start_boundary_ts,)
-    ).fetchone()
-    start_ts = previous_snapshot_query['start_ts'] if previous_snapshot_query and previous_snapshot_query['start_ts'] is not None else None
-
-    if not start_ts or not end_ts or start_ts == end_ts:
-        conn.close()
-        return []
-
-    start_data_rows = conn.execute(f'SELECT {id_col}, {val_col} FROM {table_name} WHERE snapshot_timestamp = ?', (start_ts,)).fetchall()
-    end_data_rows = conn.execute(f'SELECT {id_col}, {val_col} FROM {table_name} WHERE snapshot_timestamp = ?', (end_ts,)).fetchall()
-    conn.close()
-    
-    start_map = {row[id_col]: row[val_col] for row in start_data_rows}
-    end_map = {row[id_col]: row[val_col] for row in end_data_rows}
-    
-    progress_list = []
-    for item_id, end_value in end_map.items():
-        try:
-            start_value = int(start_map.get(item_id, 0) or 0)
-            current_end_value = int(end_value or 0)
-        except (ValueError, TypeError): continue
-        
-        progress = current_end_value - start_value
-        if progress > 0:
-            progress_list.append({"name": item_id, "progress": progress, "end_value": current_end_value})
-            
-    progress_list.sort(key=lambda x: x['progress'], reverse=True)
-    return progress_list
+    member = resolve_member(conn, request.args.get('member'))
+    return jsonify({**load_analytics(conn, member, kind), "half_lives": HALF_LIVES, "eta_half_life": ETA_HALF_LIFE})
 
-@app.route('/api/diff/collections')
-def get_collection_progress():
-    time_range = request.args.get('range', 'today')
-    return jsonify(get_progress_data('collection_snapshots', 'collection_name', 'amount', time_range))
+DASHBOARD_SECTIONS = ['latest', 'diff:collections', 'diff:bestiary', 'history:skills', 'history:collections', 'history:bestiary', 'history:profile_stats']
+
+@app.route('/api/dashboard')
+@cached
+def get_dashboard():
+    """Everything the dashboard needs in one response, read from one snapshot.
 
-@app.route('/api/diff/bestiary')
-def get_bestiary_progress():
+    `sections` is a comma-separated list of `latest`, `diff:<kind>`,
+    `history:<kind>` and `analytics:<kind>`; any section may pin its own range as `section@30d`.
+    Without one, sections use `range` if given, else the default of the
+    matching standalone endpoint. `points`, `bucket` and `member` work as there.
+    """
+    sections = [section for section in request.args.get('sections', ','.join(DASHBOARD_SECTIONS)).split(',') if section]
+    default_range = request.args.get('range')
+    points, bucket = parse_downsample_args(request.args)
+    conn = get_db_connection()
+    # One read transaction, so every section sees the same committed snapshot.
+    conn.execute('BEGIN')
+    try:
+        member = resolve_member(conn, request.args.get('member'))
+        latest_ts = get_latest_member_timestamp(conn, member) if member else None
+        # Sections share the member, its latest snapshot and the bounds per range.
+        # Each diff section still reads its own values in one diff_rows() query.
+        bounds_by_range = {}
+        result = {}
+        for section in sections:
+            name, _, time_range = section.partition('@')
+            kind, _, target = name.partition(':')
+            if kind == 'latest':
+                stats = None
+                if latest_ts is not None:
+                    row = conn.execute('SELECT purse, death_count, kills, bank_balance FROM profile_snapshots WHERE profile_id = ? AND member_uuid = ? AND snapshot_timestamp = ?', member + (latest_ts,)).fetchone()
+                    stats = dict(row) if row else None
+                result[section] = {"latest_timestamp": latest_ts, "profile_stats": stats}
+            elif kind == 'diff' and target in DIFF_KINDS:
+                time_range = time_range or default_range or 'today'
+                if time_range not in bounds_by_range:
+                    bounds_by_range[time_range] = get_progress_bounds(conn, member, time_range, latest_ts) if latest_ts else None
+                result[section] = load_diff(conn, member, target, bounds_by_range[time_range])
+            elif kind == 'history' and target in HISTORY_KINDS:
+                result[section] = load_history(conn, member, target, time_range or default_range or '7d', points, bucket)
+            elif kind == 'analytics' and target in ANALYTICS_KINDS:
+                result[section] = load_analytics(conn, member, target)
+            else:
+                result[section] = {"error": "Unknown section"}
+    finally:
+        conn.rollback()
+    return jsonify({"member": member[1] if member else None, "latest_timestamp": latest_ts, "sections": result})
+
+def get_bestiary_kills(conn, member, timestamp):
+    """{mob_id: kills} for one member as of `timestamp`."""
+    return series_values_at(conn, 'bestiary_snapshots', 'kills', member, timestamp)
+
+@app.route('/api/bestiary/families')
+@cached
+def get_bestiary_families():
+    conn = get_db_connection()
+    member = resolve_member(conn, request.args.get('member'))
+    kills = get_bestiary_kills(conn, member, 2 ** 62) if member else {}
+    families, unmatched = bestiary_families(kills)
+
+    islands = {}
+    for index, (island, mob_name, bracket) in enumerate(FAMILIES):
+        island_entry = islands.setdefault(island, {"bracket": bracket, "mobs": []})
+        stats = families.get(index)
+        if stats is None:
+            tier, next_tier_kills = bestiary_tier(bracket, 0)
+            stats = {"kills": 0, "tier": tier, "max_tier": len(BESTIARY_THRESHOLDS[bracket]), "next_tier_kills": next_tier_kills, "mob_ids": []}
+        island_entry["mobs"].append({"name": mob_name, **stats})
+    return jsonify({"islands": islands, "unmatched": unmatched})
+
+@app.route('/api/bestiary/tier_progress')
+@cached
+def get_bestiary_tier_progress():
     time_range = request.args.get('range', 'today')
-    return jsonify(get_progress_data('bestiary_snapshots', 'mob_id', 'kills', time_range))
+    conn = get_db_connection()
+    member = resolve_member(conn, request.args.get('member'))
+    bounds = get_progress_bounds(conn, member, time_range) if member else None
+    if bounds is None:
+        return jsonify([])
+    start_families, _ = bestiary_families(get_bestiary_kills(conn, member, bounds[0]))
+    end_families, _ = bestiary_families(get_bestiary_kills(conn, member, bounds[1]))
+
+    progress_list = []
+    for index, end in end_families.items():
+        start = start_families.get(index, {"kills": 0, "tier": 0})
+        progress = end["kills"] - start["kills"]
+        if progress > 0:
+            island, mob_name, _ = FAMILIES[index]
+            progress_list.append({"island": island, "name": mob_name, "progress": progress, "end_value": end["kills"],
+                                  "start_tier": start["tier"], "end_tier": end["tier"], "max_tier": end["max_tier"], "next_tier_kills": end["next_tier_kills"]})
+    progress_list.sort(key=lambda x: (x['end_tier'] - x['start_tier'], x['progress']), reverse=True)
+    return jsonify(progress_list)
 
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
\ No newline at end of file
@@ -0,0 +1,258 @@
+# benchmark.py
+
+import argparse
+import json
+import os
+import platform
+import resource
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# Offline performance suite: builds a multi-year database from
+# synthetic_profiles.py, then measures ingest throughput, API latency under
+# concurrent load (through the Flask test client) and database size.
+# Each phase runs in its own process so its peak RSS is its own.
+#
+#   python benchmark.py --output results.json
+#   python benchmark.py --baseline results.json   # exits 1 on regressions
+
+DEFAULT_ENDPOINTS = [
+    '/api/latest_snapshot_timestamp',
+    '/api/dashboard',
+    '/api/history/skills?range=30d',
+    '/api/history/collections?range=all&points=200',
+    '/api/history/bestiary?range=all',
+    '/api/history/profile_stats?range=all&bucket=day',
+    '/api/diff/collections?range=7d',
+    '/api/diff/bestiary?range=30d',
+    '/api/diff/collections?range=all&bucket=day',
+    '/api/analytics/collections',
+    '/api/bestiary/families',
+    '/api/bestiary/tier_progress?range=30d',
+]
+
+# metric -> True when higher is better
+METRICS = {
+    'ingest.rows_parsed_per_sec': True,
+    'ingest.snapshots_per_sec': True,
+    'ingest.peak_rss_kib': False,
+    'database.bytes': False,
+    'api.peak_rss_kib': False,
+}
+# Latencies under concurrent load are recorded, but GIL scheduling makes them
+# too noisy to gate on; regressions are judged on the serial median instead.
+LATENCY_METRICS = ('serial_p50_ms',)
+# Latency changes smaller than this are scheduler jitter, not regressions.
+MIN_LATENCY_DELTA_MS = 5.0
+
+def _peak_rss_kib():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss # KiB on Linux
+
+def _percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+# --- Phases (each runs in a child process) ---
+
+def ingest_phase(database_file, config):
+    """Generates the configured history and stores it through the collector's write path."""
+    from db_schema import connect_database
+    from hypixel_tracker import create_database_schema, store_snapshot
+    from snapshot_store import load_series_state
+    from synthetic_profiles import generate_snapshots
+
+    conn = connect_database(database_file)
+    create_database_schema(conn.cursor())
+    state = load_series_state(conn.cursor())
+    parsed_rows = written_rows = snapshots = 0
+    durations = []
+    for snapshot_timestamp, fetched, tracked in generate_snapshots(config['players'], config['years'], config['interval'], seed=config['seed'],
+                                                                   collections=config['collections'], mobs=config['mobs'], activity=config['activity']):
+        started = time.perf_counter()
+        parsed, written = store_snapshot(conn, fetched, tracked, snapshot_timestamp, state)
+        durations.append(time.perf_counter() - started)
+        parsed_rows += sum(parsed.values())
+        written_rows += sum(written.values())
+        snapshots += 1
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    conn.close()
+    total = sum(durations)
+    durations.sort()
+    return {
+        'snapshots': snapshots,
+        'rows_parsed': parsed_rows,
+        'rows_written': written_rows,
+        'seconds': round(total, 3),
+        'rows_parsed_per_sec': round(parsed_rows / total, 1),
+        'snapshots_per_sec': round(snapshots / total, 2),
+        'snapshot_p50_ms': round(_percentile(durations, 0.5) * 1000, 3),
+        'snapshot_p99_ms': round(_percentile(durations, 0.99) * 1000, 3),
+        'peak_rss_kib': _peak_rss_kib(),
+    }
+
+def api_phase(database_file, endpoints, requests_per_endpoint, concurrency, use_cache):
+    """Hits every endpoint `requests_per_endpoint` times from `concurrency` threads."""
+    import app as api
+
+    api.DATABASE_FILE = database_file
+    if not use_cache:
+        # Measure the database path, not the response cache.
+        api.response_cache.get = lambda key, generation: None
+        api.response_cache.put = lambda key, generation, body: None
+    else:
+        api.response_cache.path = os.path.join(os.path.dirname(database_file), 'benchmark_cache.db')
+    local = threading.local()
+
+    def timed_get(url):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = api.app.test_client()
+        started = time.perf_counter()
+        response = client.get(url)
+        body = response.get_data() # drains streamed responses too
+        elapsed = time.perf_counter() - started
+        return elapsed, response.status_code, len(body)
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for url in endpoints:
+            timed_get(url) # warm-up: pooled connection, statement cache
+            serial = sorted(timed_get(url)[0] * 1000 for _ in range(max(requests_per_endpoint // 4, 1)))
+            started = time.perf_counter()
+            samples = list(pool.map(timed_get, [url] * requests_per_endpoint))
+            wall = time.perf_counter() - started
+            latencies = sorted(sample[0] * 1000 for sample in samples)
+            results[url] = {
+                'serial_p50_ms': round(_percentile(serial, 0.5), 3),
+                'requests': len(samples),
+                'errors': sum(1 for sample in samples if sample[1] >= 400),
+                'response_bytes': samples[0][2],
+                'mean_ms': round(statistics.fmean(latencies), 3),
+                'p50_ms': round(_percentile(latencies, 0.5), 3),
+                'p95_ms': round(_percentile(latencies, 0.95), 3),
+                'p99_ms': round(_percentile(latencies, 0.99), 3),
+                'max_ms': round(latencies[-1], 3),
+                'requests_per_sec': round(len(samples) / wall, 1),
+            }
+    return {'endpoints': results, 'peak_rss_kib': _peak_rss_kib()}
+
+def _in_child(function, *args):
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        return pool.submit(function, *args).result()
+
+# --- Running and comparing ---
+
+def run(config, endpoints=DEFAULT_ENDPOINTS, work_dir=None):
+    """Runs every phase and returns the results document."""
+    with tempfile.TemporaryDirectory(dir=work_dir) as directory:
+        database_file = os.path.join(directory, 'benchmark.db')
+        # The phases record metrics like production does, but not into ./metrics.db.
+        os.environ['METRICS_FILE'] = os.path.join(directory, 'metrics.db')
+        print(f"Ingesting {config['players']} player(s) x {config['years']} year(s) every {config['interval']}s...")
+        ingest = _in_child(ingest_phase, database_file, config)
+        print(f"  {ingest['snapshots']} snapshots, {ingest['rows_parsed_per_sec']:.0f} rows/s parsed and stored.")
+        database = {'bytes': sum(os.path.getsize(database_file + suffix) for suffix in ('', '-wal') if os.path.exists(database_file + suffix))}
+        conn = sqlite3.connect(database_file)
+        database['tables'] = {name: conn.execute(f'SELECT COUNT(*) FROM "{name}"').fetchone()[0]
+                              for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name")}
+        conn.close()
+        print(f"Querying {len(endpoints)} endpoint(s) x {config['requests']} requests at concurrency {config['concurrency']}...")
+        api = _in_child(api_phase, database_file, endpoints, config['requests'], config['concurrency'], config['cache'])
+    return {
+        'meta': {
+            'created_at': int(time.time()),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'revision': _git_revision(),
+            'config': config,
+        },
+        'ingest': ingest,
+        'database': database,
+        'api': api,
+    }
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def _metric(results, path):
+    value = results
+    for part in path:
+        value = value.get(part) if isinstance(value, dict) else None
+    return value
+
+def compare(results, baseline, tolerance):
+    """Returns [(metric, baseline value, current value, change)] for every regression beyond `tolerance`."""
+    metrics = [(tuple(name.split('.')), higher_is_better) for name, higher_is_better in METRICS.items()]
+    metrics += [(('api', 'endpoints', url, latency), False) for url in results['api']['endpoints'] for latency in LATENCY_METRICS]
+    regressions = []
+    for path, higher_is_better in metrics:
+        current, previous = _metric(results, path), _metric(baseline, path)
+        if not current or not previous:
+            continue
+        change = current / previous - 1
+        if path[-1] in LATENCY_METRICS and current - previous < MIN_LATENCY_DELTA_MS:
+            continue
+        if (change < -tolerance) if higher_is_better else (change > tolerance):
+            regressions.append(('.'.join(path), previous, current, change))
+    return regressions
+
+def print_summary(results):
+    ingest = results['ingest']
+    print(f"\nIngest: {ingest['rows_parsed_per_sec']:.0f} rows/s, {ingest['snapshots_per_sec']:.1f} snapshots/s, "
+          f"p50 {ingest['snapshot_p50_ms']:.2f} ms, peak RSS {ingest['peak_rss_kib'] / 1024:.1f} MiB")
+    print(f"Database: {results['database']['bytes'] / 1024 / 1024:.2f} MiB")
+    print(f"API (peak RSS {results['api']['peak_rss_kib'] / 1024:.1f} MiB):")
+    for url, stats in results['api']['endpoints'].items():
+        print(f"  {url:<50} serial {stats['serial_p50_ms']:8.2f} ms  p50 {stats['p50_ms']:8.2f} ms  p95 {stats['p95_ms']:8.2f} ms  p99 {stats['p99_ms']:8.2f} ms  {stats['requests_per_sec']:7.1f} req/s  {stats['response_bytes']:>9} B"
+              + (f"  {stats['errors']} errors" if stats['errors'] else ''))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ingest and API performance on synthetic data.")
+    parser.add_argument('--players', type=int, default=3)
+    parser.add_argument('--years', type=float, default=2.0)
+    parser.add_argument('--interval', type=int, default=86400, help="seconds between snapshots")
+    parser.add_argument('--collections', type=int, default=60)
+    parser.add_argument('--mobs', type=int, default=150)
+    parser.add_argument('--activity', type=float, default=0.6)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--requests', type=int, default=100, help="requests per endpoint")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--cache', action='store_true', help="keep the response cache enabled")
+    parser.add_argument('--endpoint', action='append', dest='endpoints', help="endpoint to query (repeatable; default: a representative set)")
+    parser.add_argument('--output', default='benchmark_results.json', help="where to write the results")
+    parser.add_argument('--baseline', default=None, help="results file to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed relative regression (default 0.25 = 25%%)")
+    parser.add_argument('--work-dir', default=None, help="directory for the temporary database")
+    args = parser.parse_args()
+
+    config = {key: getattr(args, key) for key in ('players', 'years', 'interval', 'collections', 'mobs', 'activity', 'seed', 'requests', 'concurrency', 'cache')}
+    results = run(config, args.endpoints or DEFAULT_ENDPOINTS, args.work_dir)
+    print_summary(results)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to '{args.output}'.")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('meta', {}).get('config') != config:
+            print("Warning: the baseline was recorded with a different configuration.")
+        regressions = compare(results, baseline, args.tolerance)
+        for name, previous, current, change in regressions:
+            print(f"REGRESSION {name}: {previous} -> {current} ({change:+.0%})")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.tolerance:.0%} against '{args.baseline}'.")
+
+if __name__ == '__main__':
+    main()
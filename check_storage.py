@@ -0,0 +1,194 @@
+# check_storage.py
+
+import argparse
+import os
+import sys
+import tempfile
+
+# Regression check for change-only storage (snapshot_store.py): stores one
+# synthetic history, with API sections switched off for stretches, as
+# "delta", as "full", as a legacy full copy compacted by migration 4 and
+# through replay_archive.py, then checks that history, point-in-time, diff
+# and rollup reads of each match what plain full copies of the payloads hold.
+#
+#   python check_storage.py    # exits 1 on a mismatch
+
+# --- Reference ---
+
+def parse_reference(snapshots):
+    """{(profile_id, member_uuid): {snapshot_timestamp: {table: {name: values}}}} of the parsed payloads."""
+    from hypixel_tracker import build_row_batches
+    from snapshot_store import SERIES_TABLES
+
+    reference = {}
+    for snapshot_timestamp, fetched, tracked in snapshots:
+        for profile_id, data in fetched.items():
+            batches = build_row_batches(data, snapshot_timestamp, tracked[profile_id])
+            for row in batches['profile_snapshots']:
+                reference.setdefault(row[:2], {})[snapshot_timestamp] = {table: {} for table in SERIES_TABLES}
+            for table in SERIES_TABLES:
+                for row in batches[table]:
+                    reference[row[:2]][snapshot_timestamp][table][row[3]] = tuple(row[4:])
+    return reference
+
+def _as_of(member_snapshots, timestamp):
+    """The member's snapshot timestamps, and the last one at or before `timestamp` (or None)."""
+    timestamps = sorted(member_snapshots)
+    earlier = [ts for ts in timestamps if ts <= timestamp]
+    return timestamps, earlier[-1] if earlier else None
+
+# --- Stores ---
+
+def build_stores(directory, snapshots):
+    """Writes `snapshots` into one database per storage path. Returns {label: path}."""
+    import hypixel_tracker
+    from db_schema import MIGRATIONS, connect_database, migrate
+    from raw_archive import archive_response
+    from replay_archive import replay
+    from snapshot_store import SERIES_TABLES, load_series_state
+
+    stores = {}
+    archive_dir = os.path.join(directory, 'archive')
+    for storage in ('delta', 'full'):
+        path = stores[storage] = os.path.join(directory, f'{storage}.db')
+        hypixel_tracker.SNAPSHOT_STORAGE = storage
+        conn = connect_database(path)
+        hypixel_tracker.create_database_schema(conn.cursor())
+        state = load_series_state(conn.cursor())
+        for snapshot_timestamp, fetched, tracked in snapshots:
+            if storage == 'delta':
+                for profile_id, data in fetched.items():
+                    archive_response(profile_id, snapshot_timestamp, data, tracked[profile_id], archive_dir)
+            hypixel_tracker.store_snapshot(conn, fetched, tracked, snapshot_timestamp, state)
+        conn.close()
+    hypixel_tracker.SNAPSHOT_STORAGE = 'delta'
+
+    # Full copies as schema version 3 stored them, then the remaining migrations.
+    path = stores['migrated'] = os.path.join(directory, 'migrated.db')
+    conn = connect_database(path)
+    cursor = conn.cursor()
+    cursor.execute('BEGIN IMMEDIATE')
+    for migration in MIGRATIONS[:3]:
+        migration(cursor)
+    cursor.execute('PRAGMA user_version = 3')
+    for snapshot_timestamp, fetched, tracked in snapshots:
+        for profile_id, data in fetched.items():
+            batches = hypixel_tracker.build_row_batches(data, snapshot_timestamp, tracked[profile_id])
+            cursor.executemany('INSERT INTO profile_snapshots (profile_id, member_uuid, snapshot_timestamp, cute_name, purse, death_count, kills, bank_balance) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', batches['profile_snapshots'])
+            for table, (name_col, value_cols) in SERIES_TABLES.items():
+                cursor.executemany(f'INSERT INTO {table} (profile_id, member_uuid, snapshot_timestamp, {name_col}, {", ".join(value_cols)}) VALUES ({", ".join("?" * (4 + len(value_cols)))})', batches[table])
+    conn.commit()
+    migrate(conn)
+    conn.close()
+
+    stores['replayed'] = os.path.join(directory, 'replayed.db')
+    replay(stores['replayed'], archive_dir, workers=2)
+    return stores
+
+# --- Checks ---
+
+def check_history(conn, reference):
+    """read_history_rows() and iter_history_points() return exactly the stored series."""
+    from history import SERIES_KINDS, history_names, iter_history_points, read_history_rows
+
+    mismatches = 0
+    for member, member_snapshots in reference.items():
+        timestamps = sorted(member_snapshots)
+        for start_timestamp in (0, timestamps[len(timestamps) // 3], timestamps[-5]):
+            for kind, table in SERIES_KINDS.items():
+                expected = {}
+                for ts in timestamps:
+                    if ts >= start_timestamp:
+                        for name, values in member_snapshots[ts][table].items():
+                            expected.setdefault(name, []).append((ts, values[0]))
+                rows = {}
+                for name, value, ts in read_history_rows(conn, kind, member, start_timestamp):
+                    rows.setdefault(name, []).append((ts, value))
+                points = {name: list(iter_history_points(conn, kind, member, name, start_timestamp)) for name in history_names(conn, kind, member)}
+                points = {name: series for name, series in points.items() if series}
+                mismatches += (rows != expected) + (points != expected)
+    return mismatches
+
+def check_values_at(conn, reference):
+    """values_at() between and at snapshots matches the member's last snapshot."""
+    from snapshot_store import SERIES_TABLES, values_at
+
+    mismatches = 0
+    for member, member_snapshots in reference.items():
+        timestamps = sorted(member_snapshots)
+        for timestamp in timestamps[::7] + [ts + 1 for ts in timestamps[3::11]]:
+            _, as_of = _as_of(member_snapshots, timestamp)
+            for table in SERIES_TABLES:
+                mismatches += values_at(conn, table, member, timestamp) != member_snapshots[as_of][table]
+    return mismatches
+
+def check_diff(conn, reference):
+    """Unbucketed diffs compare the two snapshots' values like the original endpoint did."""
+    from diff_engine import DIFF_KINDS, diff_rows, window_bounds
+
+    mismatches = 0
+    for member, member_snapshots in reference.items():
+        timestamps = sorted(member_snapshots)
+        for start_timestamp in timestamps[1::13]:
+            bounds = window_bounds(conn, member, start_timestamp)
+            for kind, (table, value_col) in DIFF_KINDS.items():
+                if table is None:
+                    continue
+                start_map, end_map = (member_snapshots[ts][table] for ts in bounds)
+                expected = sorted((name, end[0] - (start_map[name][0] if name in start_map else 0), end[0])
+                                  for name, end in end_map.items() if end[0] - (start_map[name][0] if name in start_map else 0) != 0)
+                rows = sorted((row[0], row[2], row[3]) for row in diff_rows(conn, kind, member, *bounds))
+                mismatches += rows != expected
+    return mismatches
+
+def check_rollups(conn, reference):
+    """Each rollup bucket holds the series of the bucket's last snapshot."""
+    from history import ROLLUPS, SERIES_KINDS, read_rollup
+
+    mismatches = 0
+    for member, member_snapshots in reference.items():
+        timestamps = sorted(member_snapshots)
+        for bucket, (_, bucket_size) in ROLLUPS.items():
+            last = {}
+            for ts in timestamps:
+                last[ts - ts % bucket_size] = ts
+            for kind, table in SERIES_KINDS.items():
+                expected = sorted((name, values[0], ts) for ts in last.values() for name, values in member_snapshots[ts][table].items())
+                mismatches += sorted(read_rollup(conn, kind, member, bucket, 0)) != expected
+    return mismatches
+
+CHECKS = [check_history, check_values_at, check_diff, check_rollups]
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that every storage path reads back the same history, API gaps included.")
+    parser.add_argument('--players', type=int, default=2)
+    parser.add_argument('--snapshots', type=int, default=400)
+    parser.add_argument('--interval', type=int, default=8 * 3600, help="seconds between snapshots")
+    parser.add_argument('--gaps', type=float, default=0.05, help="chance per interval that a player switches an API section off or back on")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Nothing outside the temporary directory: no metrics, no shared response cache.
+        os.environ['METRICS_FILE'] = ''
+        import response_cache
+        from db_schema import connect_database
+        from synthetic_profiles import generate_snapshots
+
+        response_cache.CACHE_FILE = os.path.join(directory, 'response_cache.db')
+        snapshots = list(generate_snapshots(args.players, args.snapshots * args.interval / (365 * 86400), args.interval, start=1700000000,
+                                            seed=args.seed, collections=20, mobs=40, gaps=args.gaps))
+        reference = parse_reference(snapshots)
+        stores = build_stores(directory, snapshots)
+        failed = False
+        for label, path in stores.items():
+            conn = connect_database(path)
+            for check in CHECKS:
+                mismatches = check(conn, reference)
+                failed = failed or mismatches > 0
+                print(f"{'ok  ' if not mismatches else 'FAIL'} {label} {check.__name__}: {mismatches} mismatch(es)")
+            conn.close()
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
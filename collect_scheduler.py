@@ -0,0 +1,226 @@
+# collect_scheduler.py
+
+import argparse
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+
+# Collection runs are queued as jobs in a small SQLite file shared by every
+# gunicorn worker and executed by one long-lived collector process, which
+# keeps the imported constants, the migrated database connection and the
+# HTTP session (and its rate-limit budget) warm between runs.
+#
+# A trigger joins the queued or running job instead of starting another
+# one (single-flight), and a new job is only created once MIN_INTERVAL
+# seconds have passed since the last successful run started. When no live
+# collector process is found, the trigger starts one, unless
+# COLLECT_SPAWN_WORKER=0 says something else (supervisord) owns the process.
+#
+#   python collect_scheduler.py            run the collector process
+#   python collect_scheduler.py --trigger  queue a run (e.g. from cron)
+
+JOBS_FILE = os.getenv("COLLECT_JOBS_FILE", "collect_jobs.db")
+MIN_INTERVAL = int(os.getenv("COLLECT_MIN_INTERVAL", 60)) # seconds between successful runs
+SPAWN_WORKER = os.getenv("COLLECT_SPAWN_WORKER", "1") not in ("0", "false", "")
+POLL_INTERVAL = 1.0
+HEARTBEAT_INTERVAL = 2.0
+HEARTBEAT_TIMEOUT = 15.0
+WORKER_SCRIPT = os.path.abspath(__file__)
+
+# --- Job store ---
+
+# Paths whose schema this process has already set up.
+_prepared = set()
+_prepare_lock = threading.Lock()
+
+def connect_jobs(path=JOBS_FILE, read_only=False):
+    """Opens the job store, setting up its schema on the first connect per process.
+
+    `read_only` connections (status polls) never write to the file.
+    """
+    conn = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    with _prepare_lock:
+        if os.path.abspath(path) not in _prepared:
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('''CREATE TABLE IF NOT EXISTS collect_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, state TEXT NOT NULL, requested_at REAL NOT NULL,
+                started_at REAL, finished_at REAL, triggers INTEGER NOT NULL DEFAULT 1,
+                snapshot_timestamp INTEGER, message TEXT)''')
+            conn.execute('CREATE TABLE IF NOT EXISTS collect_worker (id INTEGER PRIMARY KEY CHECK (id = 1), pid INTEGER, heartbeat_at REAL, spawned_at REAL)')
+            conn.execute('INSERT OR IGNORE INTO collect_worker (id) VALUES (1)')
+            _prepared.add(os.path.abspath(path))
+    if read_only:
+        conn.execute('PRAGMA query_only = ON')
+    return conn
+
+def job_status(conn, job_id):
+    """The job as a dict, or None if it does not exist."""
+    row = conn.execute('SELECT * FROM collect_jobs WHERE id = ?', (job_id,)).fetchone()
+    return dict(row) if row else None
+
+def _worker_alive(worker, now):
+    return worker['heartbeat_at'] is not None and now - worker['heartbeat_at'] < HEARTBEAT_TIMEOUT
+
+def trigger(conn, spawn=None):
+    """Queues a collection run, or joins the one already queued or running.
+
+    Starts a collector process when none is alive and `spawn` (default
+    SPAWN_WORKER) is set. Returns (job dict, outcome) where outcome is
+    "queued", "joined" or "throttled" (a run succeeded less than MIN_INTERVAL
+    ago; the job is that run).
+    """
+    spawn = SPAWN_WORKER if spawn is None else spawn
+    now = time.time()
+    start_worker = False
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        worker = conn.execute('SELECT * FROM collect_worker WHERE id = 1').fetchone()
+        alive = _worker_alive(worker, now)
+        if not alive:
+            # A run whose collector stopped heartbeating will never finish.
+            conn.execute("UPDATE collect_jobs SET state = 'failed', finished_at = ?, message = 'Collector process stopped.' WHERE state = 'running'", (now,))
+        active = conn.execute("SELECT id FROM collect_jobs WHERE state IN ('queued', 'running') ORDER BY id LIMIT 1").fetchone()
+        last_success = conn.execute("SELECT id, started_at FROM collect_jobs WHERE state = 'succeeded' ORDER BY id DESC LIMIT 1").fetchone()
+        if active is not None:
+            job_id, outcome = active['id'], 'joined'
+            conn.execute('UPDATE collect_jobs SET triggers = triggers + 1 WHERE id = ?', (job_id,))
+        elif last_success is not None and now - last_success['started_at'] < MIN_INTERVAL:
+            job_id, outcome = last_success['id'], 'throttled'
+        else:
+            job_id = conn.execute("INSERT INTO collect_jobs (state, requested_at) VALUES ('queued', ?)", (now,)).lastrowid
+            outcome = 'queued'
+        if outcome != 'throttled' and spawn and not alive and (worker['spawned_at'] is None or now - worker['spawned_at'] > HEARTBEAT_TIMEOUT):
+            conn.execute('UPDATE collect_worker SET spawned_at = ? WHERE id = 1', (now,))
+            start_worker = True
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    if start_worker:
+        spawn_worker()
+    return job_status(conn, job_id), outcome
+
+def seconds_until_next_run(job):
+    """How long a throttled trigger has to wait before a new run may start."""
+    return max(int(job['started_at'] + MIN_INTERVAL - time.time()) + 1, 1)
+
+def spawn_worker():
+    """Starts a detached collector process."""
+    # Same working directory as the caller, so relative database paths agree.
+    subprocess.Popen([sys.executable, WORKER_SCRIPT], start_new_session=True)
+
+# --- Collector process ---
+
+def _heartbeat(path, stop):
+    conn = connect_jobs(path)
+    while not stop.wait(HEARTBEAT_INTERVAL):
+        conn.execute('UPDATE collect_worker SET heartbeat_at = ? WHERE id = 1 AND pid = ?', (time.time(), os.getpid()))
+    conn.close()
+
+def _register(conn):
+    """Makes this process the collector unless another live one already is."""
+    now = time.time()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        worker = conn.execute('SELECT * FROM collect_worker WHERE id = 1').fetchone()
+        if _worker_alive(worker, now) and worker['pid'] != os.getpid():
+            conn.execute('ROLLBACK')
+            return False
+        conn.execute('UPDATE collect_worker SET pid = ?, heartbeat_at = ? WHERE id = 1', (os.getpid(), now))
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    return True
+
+def _claim(conn):
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        job = conn.execute("SELECT id FROM collect_jobs WHERE state = 'queued' ORDER BY id LIMIT 1").fetchone()
+        if job is not None:
+            conn.execute("UPDATE collect_jobs SET state = 'running', started_at = ? WHERE id = ?", (time.time(), job['id']))
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    return job['id'] if job else None
+
+def _finish(conn, job_id, state, snapshot_timestamp=None, message=None):
+    conn.execute('UPDATE collect_jobs SET state = ?, finished_at = ?, snapshot_timestamp = ?, message = ? WHERE id = ?',
+                 (state, time.time(), snapshot_timestamp, message, job_id))
+
+def run_worker(path=JOBS_FILE, wait=False):
+    """Runs queued collection jobs until interrupted.
+
+    With `wait`, a live collector elsewhere is waited out instead of exiting,
+    so a process manager does not keep restarting this one.
+    """
+    # Imported here so the web app can queue jobs without loading the collector.
+    import hypixel_tracker
+    from db_schema import connect_database
+
+    conn = connect_jobs(path)
+    while not _register(conn):
+        if not wait:
+            print("Another collector process is already running.")
+            return
+        time.sleep(HEARTBEAT_INTERVAL)
+    stop = threading.Event()
+    threading.Thread(target=_heartbeat, args=(path, stop), daemon=True).start()
+    database = connect_database(hypixel_tracker.DATABASE_FILE)
+    hypixel_tracker.create_database_schema(database.cursor())
+    client = hypixel_tracker.create_client(hypixel_tracker.API_KEY)
+    # supervisord stops programs with SIGTERM; unwind so the heartbeat is cleared.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print(f"Collector process {os.getpid()} waiting for jobs.")
+    job_id = None
+    try:
+        while True:
+            job_id = _claim(conn)
+            if job_id is None:
+                time.sleep(POLL_INTERVAL)
+                continue
+            print(f"Starting collection job {job_id}.")
+            try:
+                result = hypixel_tracker.collect(database, client)
+            except Exception as e:
+                print(f"Collection job {job_id} failed: {e}")
+                _finish(conn, job_id, 'failed', message=str(e))
+            else:
+                if result is None:
+                    _finish(conn, job_id, 'failed', message="No profile could be fetched.")
+                else:
+                    _finish(conn, job_id, 'succeeded', result['snapshot_timestamp'],
+                            f"Stored {result['profiles']} profile(s), {sum(result['written'].values())} rows written.")
+            job_id = None
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        if job_id is not None:
+            _finish(conn, job_id, 'failed', message="Collector process stopped.")
+        stop.set()
+        client.close()
+        database.close()
+        conn.execute('UPDATE collect_worker SET heartbeat_at = NULL WHERE id = 1 AND pid = ?', (os.getpid(),))
+        conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the collector process or queue a collection run.")
+    parser.add_argument('--trigger', action='store_true', help="queue a run (starting the collector if needed) and exit")
+    parser.add_argument('--wait', action='store_true', help="if another collector is running, wait to take over instead of exiting")
+    args = parser.parse_args()
+    if args.trigger:
+        conn = connect_jobs()
+        job, outcome = trigger(conn)
+        print(f"Collection job {job['id']}: {outcome} ({job['state']}).")
+        conn.close()
+    else:
+        run_worker(wait=args.wait)
+
+if __name__ == '__main__':
+    main()
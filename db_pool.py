@@ -0,0 +1,65 @@
+# db_pool.py
+
+import os
+import sqlite3
+import threading
+
+from metrics import CONNECTION_FACTORY
+
+# The API only reads, so every worker thread keeps one read-only connection
+# open for its whole life instead of reconnecting per request. That keeps the
+# parsed schema, the page cache and sqlite3's prepared-statement cache warm.
+
+CACHE_SIZE_KIB = int(os.getenv("SQLITE_READ_CACHE_KIB", 16384))
+MMAP_SIZE_BYTES = int(os.getenv("SQLITE_READ_MMAP_BYTES", 256 * 1024 * 1024))
+CACHED_STATEMENTS = 256
+
+class ReadOnlyPool:
+    """Thread-local, read-only (`mode=ro`) SQLite connections with health checks."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _open(self):
+        conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False, cached_statements=CACHED_STATEMENTS, factory=CONNECTION_FACTORY)
+        conn.row_factory = sqlite3.Row
+        conn.execute(f'PRAGMA cache_size = -{CACHE_SIZE_KIB}')
+        conn.execute(f'PRAGMA mmap_size = {MMAP_SIZE_BYTES}')
+        conn.execute('PRAGMA query_only = ON')
+        return conn
+
+    def _signature(self, conn):
+        # A replaced file (restore, rebuild) has a new inode; a migration bumps user_version.
+        stat = os.stat(self.path)
+        return (stat.st_dev, stat.st_ino, conn.execute('PRAGMA user_version').fetchone()[0])
+
+    def get(self):
+        """Returns this thread's connection, reopening it if it went stale."""
+        local = self._local
+        conn = getattr(local, 'conn', None)
+        # A connection inherited across fork() is left alone, never used or closed.
+        if conn is not None and local.pid == os.getpid():
+            try:
+                if self._signature(conn) == local.signature:
+                    return conn
+            except (OSError, sqlite3.Error):
+                pass
+            self._discard(conn)
+        conn = self._open()
+        local.conn, local.pid, local.signature = conn, os.getpid(), self._signature(conn)
+        return conn
+
+    def close(self):
+        """Closes this thread's connection, if any."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            self._discard(conn)
+            self._local.conn = None
+
+    @staticmethod
+    def _discard(conn):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
@@ -0,0 +1,189 @@
+# db_schema.py
+
+import sqlite3
+
+from history import rebuild_rollups
+from metrics import CONNECTION_FACTORY
+from snapshot_store import SERIES_TABLES, compact_series_table, rebuild_series_state
+
+# The schema version is stored in SQLite's built-in `PRAGMA user_version`.
+# Every entry in MIGRATIONS upgrades the database by exactly one version and
+# runs inside its own IMMEDIATE transaction, so a crashed or concurrent run
+# never leaves a half-migrated file behind.
+
+# --- Snapshot table layout ---
+
+# (table, series name column, value column definitions)
+SNAPSHOT_TABLES = [
+    ('skill_snapshots', 'skill_name', 'total_xp REAL, level INTEGER'),
+    ('slayer_snapshots', 'slayer_name', 'total_xp INTEGER, tier1_kills INTEGER, tier2_kills INTEGER, tier3_kills INTEGER, tier4_kills INTEGER, tier5_kills INTEGER'),
+    ('collection_snapshots', 'collection_name', 'amount INTEGER, tier INTEGER'),
+    ('bestiary_snapshots', 'mob_id', 'kills INTEGER'),
+]
+
+# --- Migrations ---
+
+def _migration_1_baseline(cursor):
+    """The original schema, including the later bank_balance column."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS profile_snapshots (
+            profile_id TEXT NOT NULL, member_uuid TEXT NOT NULL, snapshot_timestamp INTEGER NOT NULL,
+            cute_name TEXT, purse REAL, death_count INTEGER, kills INTEGER, bank_balance REAL,
+            PRIMARY KEY (profile_id, member_uuid, snapshot_timestamp)
+        )
+    ''')
+    try:
+        cursor.execute('ALTER TABLE profile_snapshots ADD COLUMN bank_balance REAL')
+    except sqlite3.OperationalError:
+        pass # Column already exists
+
+    cursor.execute('''CREATE TABLE IF NOT EXISTS skill_snapshots (snapshot_id INTEGER PRIMARY KEY, member_uuid TEXT, profile_id TEXT, snapshot_timestamp INTEGER, skill_name TEXT, total_xp REAL, level INTEGER, FOREIGN KEY (profile_id, member_uuid, snapshot_timestamp) REFERENCES profile_snapshots (profile_id, member_uuid, snapshot_timestamp))''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS slayer_snapshots (snapshot_id INTEGER PRIMARY KEY, member_uuid TEXT, profile_id TEXT, snapshot_timestamp INTEGER, slayer_name TEXT, total_xp INTEGER, tier1_kills INTEGER, tier2_kills INTEGER, tier3_kills INTEGER, tier4_kills INTEGER, tier5_kills INTEGER, FOREIGN KEY (profile_id, member_uuid, snapshot_timestamp) REFERENCES profile_snapshots (profile_id, member_uuid, snapshot_timestamp))''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS collection_snapshots (snapshot_id INTEGER PRIMARY KEY, member_uuid TEXT, profile_id TEXT, snapshot_timestamp INTEGER, collection_name TEXT, amount INTEGER, tier INTEGER, FOREIGN KEY (profile_id, member_uuid, snapshot_timestamp) REFERENCES profile_snapshots (profile_id, member_uuid, snapshot_timestamp))''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS bank_transactions (transaction_id INTEGER PRIMARY KEY, profile_id TEXT, timestamp INTEGER UNIQUE, action TEXT, amount REAL, initiator_name TEXT)''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS bestiary_snapshots (snapshot_id INTEGER PRIMARY KEY, member_uuid TEXT, profile_id TEXT, snapshot_timestamp INTEGER, mob_id TEXT, kills INTEGER, UNIQUE(profile_id, member_uuid, snapshot_timestamp, mob_id))''')
+
+def _rebuild_table(cursor, table, create_sql, columns):
+    """Copies `table` into a new layout, dropping duplicate keys on the way."""
+    cursor.execute(f'DROP TABLE IF EXISTS {table}_new')
+    cursor.execute(create_sql.format(name=f'{table}_new'))
+    column_list = ', '.join(columns)
+    cursor.execute(f'INSERT OR IGNORE INTO {table}_new ({column_list}) SELECT {column_list} FROM {table} ORDER BY profile_id, member_uuid, snapshot_timestamp')
+    cursor.execute(f'DROP TABLE {table}')
+    cursor.execute(f'ALTER TABLE {table}_new RENAME TO {table}')
+
+def _migration_2_clustered_snapshots(cursor):
+    """Rebuilds the snapshot tables as WITHOUT ROWID tables clustered on
+    (profile_id, member_uuid, snapshot_timestamp, name) and indexes the
+    timestamp so range scans and MAX() lookups stop scanning whole tables."""
+    _rebuild_table(cursor, 'profile_snapshots', '''
+        CREATE TABLE {name} (
+            profile_id TEXT NOT NULL, member_uuid TEXT NOT NULL, snapshot_timestamp INTEGER NOT NULL,
+            cute_name TEXT, purse REAL, death_count INTEGER, kills INTEGER, bank_balance REAL,
+            PRIMARY KEY (profile_id, member_uuid, snapshot_timestamp)
+        ) WITHOUT ROWID
+    ''', ['profile_id', 'member_uuid', 'snapshot_timestamp', 'cute_name', 'purse', 'death_count', 'kills', 'bank_balance'])
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_profile_snapshots_ts ON profile_snapshots (snapshot_timestamp)')
+
+    for table, name_col, value_defs in SNAPSHOT_TABLES:
+        value_cols = [definition.split()[0] for definition in value_defs.split(', ')]
+        _rebuild_table(cursor, table, f'''
+            CREATE TABLE {{name}} (
+                profile_id TEXT NOT NULL, member_uuid TEXT NOT NULL, snapshot_timestamp INTEGER NOT NULL,
+                {name_col} TEXT NOT NULL, {value_defs},
+                PRIMARY KEY (profile_id, member_uuid, snapshot_timestamp, {name_col}),
+                FOREIGN KEY (profile_id, member_uuid, snapshot_timestamp) REFERENCES profile_snapshots (profile_id, member_uuid, snapshot_timestamp)
+            ) WITHOUT ROWID
+        ''', ['profile_id', 'member_uuid', 'snapshot_timestamp', name_col] + value_cols)
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_ts ON {table} (snapshot_timestamp)')
+
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_bank_transactions_profile ON bank_transactions (profile_id, timestamp)')
+
+def _migration_3_rollups(cursor):
+    """Adds the hourly and daily rollup tables read by long-range history queries.
+    They are filled in by migration 4 once the snapshot tables are compacted."""
+    for table in ('rollup_hourly', 'rollup_daily'):
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                kind TEXT NOT NULL, profile_id TEXT NOT NULL, member_uuid TEXT NOT NULL,
+                bucket_start INTEGER NOT NULL, name TEXT NOT NULL, snapshot_timestamp INTEGER NOT NULL, value,
+                PRIMARY KEY (kind, profile_id, member_uuid, bucket_start, name)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_bucket ON {table} (kind, bucket_start)')
+
+def _migration_4_change_only_snapshots(cursor):
+    """Switches the series tables to change-only storage: adds series_state,
+    indexes each series for point-in-time seeks and compacts the existing
+    full copies down to the rows where a value actually changed."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS series_state (
+            kind TEXT NOT NULL, profile_id TEXT NOT NULL, member_uuid TEXT NOT NULL, name TEXT NOT NULL,
+            snapshot_timestamp INTEGER NOT NULL, value TEXT,
+            PRIMARY KEY (kind, profile_id, member_uuid, name)
+        ) WITHOUT ROWID
+    ''')
+    for table, (name_col, _) in SERIES_TABLES.items():
+        cursor.execute(f'DROP INDEX IF EXISTS idx_{table}_ts')
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_series ON {table} (profile_id, member_uuid, {name_col}, snapshot_timestamp)')
+        added, removed = compact_series_table(cursor, table)
+        print(f"  - Compacted {table}: removed {removed} unchanged rows, added {added} absence rows.")
+    rebuild_series_state(cursor)
+    rebuild_rollups(cursor)
+    return True # Reclaim the space freed by compaction
+
+def _migration_5_bank_transactions_per_profile(cursor):
+    """Keys bank_transactions on (profile_id, timestamp) instead of a global
+    UNIQUE timestamp, which dropped a transaction whenever another profile had
+    one in the same millisecond."""
+    cursor.execute('DROP TABLE IF EXISTS bank_transactions_new')
+    cursor.execute('''
+        CREATE TABLE bank_transactions_new (
+            profile_id TEXT NOT NULL, timestamp INTEGER NOT NULL, action TEXT, amount REAL, initiator_name TEXT,
+            PRIMARY KEY (profile_id, timestamp)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        INSERT OR IGNORE INTO bank_transactions_new (profile_id, timestamp, action, amount, initiator_name)
+        SELECT profile_id, timestamp, action, amount, initiator_name FROM bank_transactions ORDER BY profile_id, timestamp
+    ''')
+    cursor.execute('DROP TABLE bank_transactions') # and idx_bank_transactions_profile, now the primary key
+    cursor.execute('ALTER TABLE bank_transactions_new RENAME TO bank_transactions')
+
+MIGRATIONS = [
+    _migration_1_baseline,
+    _migration_2_clustered_snapshots,
+    _migration_3_rollups,
+    _migration_4_change_only_snapshots,
+    _migration_5_bank_transactions_per_profile,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+# --- Connections ---
+
+def connect_database(path, timeout=30):
+    """Opens a read-write connection tuned for the collector.
+
+    WAL lets the API's readers keep reading while the collector writes, and
+    synchronous=NORMAL is durable enough in WAL mode at a fraction of the fsyncs.
+    """
+    conn = sqlite3.connect(path, timeout=timeout, factory=CONNECTION_FACTORY)
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute('PRAGMA cache_size = -65536') # 64 MiB
+    conn.execute('PRAGMA temp_store = MEMORY')
+    return conn
+
+# --- Runner ---
+
+def get_schema_version(conn):
+    """Returns the schema version recorded in the database file."""
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def migrate(conn):
+    """Applies every pending migration in order and returns the final version.
+
+    A migration that returns True asks for a VACUUM once all steps are done.
+    """
+    if conn.in_transaction:
+        conn.commit()
+    needs_vacuum = False
+    while True:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Re-read inside the write lock so concurrent runs never apply the same step twice.
+            version = get_schema_version(conn)
+            if version >= SCHEMA_VERSION:
+                conn.rollback()
+                if needs_vacuum:
+                    conn.execute('VACUUM')
+                return version
+            cursor = conn.cursor()
+            needs_vacuum = MIGRATIONS[version](cursor) or needs_vacuum
+            cursor.execute(f'PRAGMA user_version = {version + 1}')
+            conn.commit()
+            print(f"Migrated database schema to version {version + 1}.")
+        except Exception:
+            conn.rollback()
+            raise
@@ -0,0 +1,128 @@
+# diff_engine.py
+
+from history import PROFILE_STATS_SOURCE
+from snapshot_store import SERIES_TABLES, absent_condition
+
+# Progress between two snapshots, or per time bucket in between, computed in
+# one SQL statement per call.
+#
+# Series tables hold a row only when a value changed (see snapshot_store), so
+# the progress over (baseline, end] is the sum of every change in that range
+# minus the value before it. The query seeds each series with its value as of
+# the baseline snapshot, appends the change rows in range, takes LAG() over
+# each series to turn values into deltas, and sums the deltas per bucket.
+# An absence row (see snapshot_store) has a NULL value: absent at the baseline
+# a series counts from zero, absent at the end it is left out, and absence
+# rows inside the window are skipped.
+# Window edges are resolved against profile_snapshots, whose primary key
+# (profile_id, member_uuid, snapshot_timestamp) already orders every member's
+# snapshots.
+
+# diff kind -> (change-only table, value column); profile_stats reads profile_snapshots.
+DIFF_KINDS = {
+    'skills': ('skill_snapshots', 'total_xp'),
+    'slayers': ('slayer_snapshots', 'total_xp'),
+    'collections': ('collection_snapshots', 'amount'),
+    'bestiary': ('bestiary_snapshots', 'kills'),
+    'profile_stats': (None, None),
+}
+
+def window_bounds(conn, member, start_timestamp=0, end_timestamp=None):
+    """Returns (baseline, end): the snapshots a diff over [start, end] compares.
+
+    The baseline is the member's last snapshot before `start_timestamp`, or,
+    when tracking began inside the window, their first snapshot. `end` is their
+    last snapshot at or before `end_timestamp`. None when the window holds
+    fewer than two snapshots.
+    """
+    if end_timestamp is None:
+        end_timestamp = 2 ** 62
+    row = conn.execute('''
+        SELECT COALESCE(
+                   (SELECT MAX(snapshot_timestamp) FROM profile_snapshots WHERE profile_id = ?1 AND member_uuid = ?2 AND snapshot_timestamp < ?3),
+                   (SELECT MIN(snapshot_timestamp) FROM profile_snapshots WHERE profile_id = ?1 AND member_uuid = ?2 AND snapshot_timestamp >= ?3)),
+               (SELECT MAX(snapshot_timestamp) FROM profile_snapshots WHERE profile_id = ?1 AND member_uuid = ?2 AND snapshot_timestamp <= ?4)
+    ''', (member[0], member[1], start_timestamp, end_timestamp)).fetchone()
+    baseline, end = row
+    if baseline is None or end is None or baseline >= end:
+        return None
+    return baseline, end
+
+def _window_rows(kind, bucketed):
+    """SQL for (name, value, snapshot_timestamp): every series' value at the
+    baseline, followed by its rows in (baseline, end] when `bucketed`, else by
+    its value at the end."""
+    table, value_col = DIFF_KINDS[kind]
+    if table is None:
+        # profile_snapshots has a row for every snapshot.
+        in_window = 'BETWEEN :baseline AND :end' if bucketed else 'IN (:baseline, :end)'
+        return f'''
+            SELECT name, value, snapshot_timestamp FROM ({PROFILE_STATS_SOURCE})
+            WHERE profile_id = :profile_id AND member_uuid = :member_uuid AND snapshot_timestamp {in_window}
+        '''
+    name_col = SERIES_TABLES[table][0]
+
+    def value_as_of(timestamp):
+        return f'''
+            SELECT s.name, (
+                       SELECT t.{value_col} FROM {table} t INDEXED BY idx_{table}_series
+                       WHERE t.profile_id = s.profile_id AND t.member_uuid = s.member_uuid AND t.{name_col} = s.name AND t.snapshot_timestamp <= {timestamp}
+                       ORDER BY t.snapshot_timestamp DESC LIMIT 1), {timestamp}
+            FROM series_state s WHERE s.kind = :table AND s.profile_id = :profile_id AND s.member_uuid = :member_uuid
+        '''
+
+    if not bucketed:
+        # Two index seeks per series, however long the window is.
+        return f'{value_as_of(":baseline")} UNION ALL {value_as_of(":end")}'
+    return f'''
+        {value_as_of(":baseline")}
+        UNION ALL
+        SELECT {name_col}, {value_col}, snapshot_timestamp FROM {table}
+        WHERE profile_id = :profile_id AND member_uuid = :member_uuid AND snapshot_timestamp > :baseline AND snapshot_timestamp <= :end
+          AND NOT {absent_condition(table)}
+    '''
+
+def diff_rows(conn, kind, member, baseline, end, bucket_size=None):
+    """Returns [(name, bucket_start, progress, end_value)] for every series that
+    changed in (baseline, end], ordered by name and bucket.
+
+    Without `bucket_size` there is one bucket, starting at `baseline`; with it,
+    buckets are `bucket_size` seconds wide and aligned like the rollups (UTC).
+    A series first seen after the baseline counts from zero. `end_value` is the
+    series' value at the end of its bucket.
+    """
+    origin, size = (0, bucket_size) if bucket_size else (baseline, 2 ** 62)
+    # `value` next to MAX(snapshot_timestamp) is taken from the bucket's last row.
+    return conn.execute(f'''
+        WITH window_rows (name, value, snapshot_timestamp) AS ({_window_rows(kind, bool(bucket_size))}),
+        deltas AS (
+            SELECT name, value, snapshot_timestamp,
+                   value - COALESCE(LAG(value) OVER (PARTITION BY name ORDER BY snapshot_timestamp), 0) AS delta
+            FROM window_rows
+        )
+        SELECT name, bucket_start, progress, value FROM (
+            SELECT name, :origin + (snapshot_timestamp - :origin) / :size * :size AS bucket_start, SUM(delta) AS progress, value, MAX(snapshot_timestamp)
+            FROM deltas WHERE snapshot_timestamp > :baseline
+            GROUP BY name, bucket_start
+        )
+        WHERE progress != 0
+        ORDER BY name, bucket_start
+    ''', {'table': DIFF_KINDS[kind][0], 'profile_id': member[0], 'member_uuid': member[1], 'baseline': baseline, 'end': end, 'origin': origin, 'size': size}).fetchall()
+
+def increases_only(kind):
+    """Counters only grow, so a drop (an API toggled off, a reset) is not progress; money can fall."""
+    return kind != 'profile_stats'
+
+def progress_list(kind, rows):
+    """Unbucketed diff_rows() as [{"name", "progress", "end_value"}], largest first."""
+    result = [{"name": row[0], "progress": row[2], "end_value": row[3]} for row in rows if row[2] > 0 or not increases_only(kind)]
+    result.sort(key=lambda item: item['progress'], reverse=True)
+    return result
+
+def progress_by_bucket(kind, rows):
+    """Bucketed diff_rows() as {name: [{"timestamp": bucket start, "progress", "end_value"}]}."""
+    result = {}
+    for name, bucket_start, progress, end_value in rows:
+        if progress > 0 or not increases_only(kind):
+            result.setdefault(name, []).append({"timestamp": bucket_start, "progress": progress, "end_value": end_value})
+    return result
@@ -0,0 +1,328 @@
+# history.py
+
+# Time-series helpers shared by the collector and the API: the hourly/daily
+# rollup tables and the server-side downsampling used by /api/history/*.
+
+import json
+import math
+from itertools import chain, islice
+
+from snapshot_store import SERIES_TABLES, forward_fill, iter_series_history, iter_series_points, series_names, values_at
+
+# --- Series definitions ---
+
+# history kind -> change-only snapshot table (see snapshot_store)
+SERIES_KINDS = {
+    'skills': 'skill_snapshots',
+    'collections': 'collection_snapshots',
+    'bestiary': 'bestiary_snapshots',
+}
+
+# profile_snapshots has a row for every snapshot, so it is read as a flat relation.
+PROFILE_STATS_COLUMNS = {
+    'total_money': 'COALESCE(purse, 0) + COALESCE(bank_balance, 0)',
+    'kills': 'kills',
+    'deaths': 'death_count',
+}
+PROFILE_STATS_SOURCE = ' UNION ALL '.join(
+    f"SELECT profile_id, member_uuid, snapshot_timestamp, '{name}' AS name, {expression} AS value FROM profile_snapshots"
+    for name, expression in PROFILE_STATS_COLUMNS.items())
+
+HISTORY_KINDS = list(SERIES_KINDS) + ['profile_stats']
+
+# bucket name -> (rollup table, bucket size in seconds)
+ROLLUPS = {
+    'hour': ('rollup_hourly', 3600),
+    'day': ('rollup_daily', 86400),
+}
+
+def read_history_rows(conn, kind, member, start_timestamp, end_timestamp=None, keep_absent=False):
+    """Yields (name, value, snapshot_timestamp) of one member's raw history, oldest first.
+
+    `keep_absent` is passed on to iter_series_history().
+    """
+    if kind in SERIES_KINDS:
+        yield from iter_series_history(conn, SERIES_KINDS[kind], member, start_timestamp, end_timestamp, keep_absent=keep_absent)
+        return
+    if end_timestamp is None:
+        end_timestamp = 2 ** 62
+    yield from conn.execute(f'''
+        SELECT name, value, snapshot_timestamp FROM ({PROFILE_STATS_SOURCE})
+        WHERE profile_id = ? AND member_uuid = ? AND snapshot_timestamp BETWEEN ? AND ?
+        ORDER BY snapshot_timestamp ASC
+    ''', (member[0], member[1], start_timestamp, end_timestamp))
+
+def history_names(conn, kind, member):
+    """Lists the series names of one history kind for a member."""
+    if kind not in SERIES_KINDS:
+        return list(PROFILE_STATS_COLUMNS)
+    return series_names(conn, SERIES_KINDS[kind], member) if member else []
+
+def iter_history_points(conn, kind, member, name, start_timestamp, end_timestamp=None):
+    """Yields (snapshot_timestamp, value) of one series of one history kind, oldest first."""
+    if member is None:
+        return
+    if kind in SERIES_KINDS:
+        yield from iter_series_points(conn, SERIES_KINDS[kind], member, name, start_timestamp, end_timestamp)
+        return
+    if end_timestamp is None:
+        end_timestamp = 2 ** 62
+    yield from conn.execute(f'''
+        SELECT snapshot_timestamp, {PROFILE_STATS_COLUMNS[name]} FROM profile_snapshots
+        WHERE profile_id = ? AND member_uuid = ? AND snapshot_timestamp BETWEEN ? AND ?
+        ORDER BY snapshot_timestamp ASC
+    ''', (member[0], member[1], start_timestamp, end_timestamp))
+
+# --- Rollup maintenance ---
+
+# Rollups follow the same change-only layout as the snapshot tables: the
+# profile_stats rows are written for every bucket and double as the bucket
+# list, while a series row is only written for buckets in which it changed.
+# Each row holds the last value seen in its bucket; the values are cumulative counters.
+# A NULL series value marks a series absent from the bucket's last snapshot.
+
+def _upsert_sql(table):
+    return f'''
+        INSERT INTO {table} (kind, profile_id, member_uuid, bucket_start, name, snapshot_timestamp, value)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (kind, profile_id, member_uuid, bucket_start, name) DO UPDATE
+        SET snapshot_timestamp = excluded.snapshot_timestamp, value = excluded.value
+        WHERE excluded.snapshot_timestamp >= {table}.snapshot_timestamp
+    '''
+
+def _changed_rows(cursor, kind, snapshot_timestamp):
+    """(profile_id, member_uuid, name, value) written by the snapshot at `snapshot_timestamp`."""
+    if kind in SERIES_KINDS:
+        return cursor.execute('''
+            SELECT profile_id, member_uuid, name, json_extract(value, '$[0]') FROM series_state
+            WHERE kind = ? AND snapshot_timestamp = ?
+        ''', (SERIES_KINDS[kind], snapshot_timestamp)).fetchall()
+    return cursor.execute(f'SELECT profile_id, member_uuid, name, value FROM ({PROFILE_STATS_SOURCE}) WHERE snapshot_timestamp = ?', (snapshot_timestamp,)).fetchall()
+
+def update_rollups(cursor, snapshot_timestamp):
+    """Folds the snapshot just written at `snapshot_timestamp` into every rollup table."""
+    for kind in HISTORY_KINDS:
+        rows = _changed_rows(cursor, kind, snapshot_timestamp)
+        for table, bucket_size in ROLLUPS.values():
+            bucket_start = snapshot_timestamp - snapshot_timestamp % bucket_size
+            cursor.executemany(_upsert_sql(table), [(kind, row[0], row[1], bucket_start, row[2], snapshot_timestamp, row[3]) for row in rows])
+
+def _bucket_changes(rows, bucket_size, keep_all):
+    """Collapses (name, value, ts) rows to the last value per bucket, dropping
+    buckets where a series kept its previous value unless `keep_all` is set."""
+    written = {}
+    bucket, last = None, {}
+    for name, value, snapshot_timestamp in rows:
+        row_bucket = snapshot_timestamp - snapshot_timestamp % bucket_size
+        if row_bucket != bucket:
+            for item in last.items():
+                if keep_all or written.get(item[0]) != item[1][0]:
+                    written[item[0]] = item[1][0]
+                    yield bucket, item[0], item[1][1], item[1][0]
+            bucket, last = row_bucket, {}
+        last[name] = (value, snapshot_timestamp)
+    for item in last.items():
+        if keep_all or written.get(item[0]) != item[1][0]:
+            yield bucket, item[0], item[1][1], item[1][0]
+
+def rebuild_rollups(cursor):
+    """Recomputes every rollup table from the stored snapshots."""
+    members = cursor.execute('SELECT DISTINCT profile_id, member_uuid FROM profile_snapshots').fetchall()
+    for table, bucket_size in ROLLUPS.values():
+        cursor.execute(f'DELETE FROM {table}')
+        for member in members:
+            for kind in HISTORY_KINDS:
+                rows = read_history_rows(cursor.connection, kind, member, 0, keep_absent=True)
+                cursor.executemany(_upsert_sql(table), ((kind, member[0], member[1], bucket_start, name, ts, value)
+                                                        for bucket_start, name, ts, value in _bucket_changes(rows, bucket_size, kind not in SERIES_KINDS)))
+
+def read_rollup(conn, kind, member, bucket, start_timestamp):
+    """Yields (name, value, snapshot_timestamp) rows of one rollup, oldest first."""
+    table, bucket_size = ROLLUPS[bucket]
+    first_bucket = start_timestamp - start_timestamp % bucket_size
+    if kind not in SERIES_KINDS:
+        yield from conn.execute(
+            f'SELECT name, value, snapshot_timestamp FROM {table} WHERE kind = ? AND profile_id = ? AND member_uuid = ? AND bucket_start >= ? AND snapshot_timestamp >= ? ORDER BY bucket_start ASC',
+            (kind, member[0], member[1], first_bucket, start_timestamp))
+        return
+    buckets = conn.execute(
+        f"SELECT bucket_start, snapshot_timestamp FROM {table} WHERE kind = 'profile_stats' AND profile_id = ? AND member_uuid = ? AND name = 'total_money' AND bucket_start >= ? AND snapshot_timestamp >= ? ORDER BY bucket_start ASC",
+        (member[0], member[1], first_bucket, start_timestamp))
+    series_table = SERIES_KINDS[kind]
+    current = {name: values[0] for name, values in values_at(conn, series_table, member, start_timestamp - 1, SERIES_TABLES[series_table][1][:1]).items()}
+    changes = conn.execute(
+        f'SELECT name, value, bucket_start, value IS NULL FROM {table} WHERE kind = ? AND profile_id = ? AND member_uuid = ? AND bucket_start >= ? ORDER BY bucket_start ASC',
+        (kind, member[0], member[1], first_bucket))
+    yield from forward_fill(iter(buckets), current, iter(changes))
+
+# --- Downsampling ---
+
+def choose_bucket(start_timestamp, end_timestamp, points):
+    """Picks the coarsest rollup that still leaves about `points` buckets in range."""
+    if not points or start_timestamp is None or end_timestamp is None:
+        return None
+    step = (end_timestamp - start_timestamp) / points
+    for bucket in ('day', 'hour'):
+        if step >= ROLLUPS[bucket][1]:
+            return bucket
+    return None
+
+def bucket_series(series, bucket_size):
+    """Keeps the last point of every `bucket_size`-second bucket."""
+    result = []
+    for point in series:
+        if result and result[-1]['timestamp'] // bucket_size == point['timestamp'] // bucket_size:
+            result[-1] = point
+        else:
+            result.append(point)
+    return result
+
+def lttb(series, threshold):
+    """Largest-Triangle-Three-Buckets downsampling to at most `threshold` points."""
+    length = len(series)
+    if threshold >= length or threshold < 3:
+        return series[:threshold] if threshold < 3 else series
+
+    xs = [point['timestamp'] for point in series]
+    ys = [point['value'] or 0 for point in series]
+    sampled = [series[0]]
+    every = (length - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # Average of the next bucket is the third triangle vertex.
+        next_start = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, length)
+        span = next_end - next_start
+        avg_x = sum(xs[next_start:next_end]) / span
+        avg_y = sum(ys[next_start:next_end]) / span
+
+        ax, ay = xs[a], ys[a]
+        best_area, best_index = -1, None
+        for j in range(int(i * every) + 1, int((i + 1) * every) + 1):
+            area = abs((ax - avg_x) * (ys[j] - ay) - (ax - xs[j]) * (avg_y - ay))
+            if area > best_area:
+                best_area, best_index = area, j
+        sampled.append(series[best_index])
+        a = best_index
+    sampled.append(series[-1])
+    return sampled
+
+def downsample(history_data, points=None, bucket_size=None):
+    """Applies time bucketing and/or LTTB to every series of a history response."""
+    result = {}
+    for key, series in history_data.items():
+        if bucket_size:
+            series = bucket_series(series, bucket_size)
+        if points:
+            series = lttb(series, points)
+        result[key] = series
+    return result
+
+def parse_downsample_args(args):
+    """Reads the `points` and `bucket` query parameters.
+
+    `bucket` is `raw`, `hour`, `day` or a bucket width in seconds. Returns
+    (points, bucket) where bucket is None, a ROLLUPS key or an int.
+    """
+    points = args.get('points', type=int)
+    if points is not None and points < 3:
+        points = 3
+    bucket = args.get('bucket')
+    if bucket in (None, '', 'raw'):
+        bucket = None
+    elif bucket not in ROLLUPS:
+        try:
+            bucket = max(int(bucket), 1)
+        except ValueError:
+            bucket = None
+    return points, bucket
+
+def to_columnar(history_data):
+    """{name: [{timestamp, value}]} -> {name: {"timestamps": [...], "values": [...]}}."""
+    return {name: {"timestamps": [point['timestamp'] for point in series], "values": [point['value'] for point in series]}
+            for name, series in history_data.items()}
+
+# --- Streaming ---
+
+# Long raw histories are serialised one series at a time straight off the
+# cursors and sent in chunks, so a request never holds more than one chunk.
+
+STREAM_CHUNK_BYTES = 64 * 1024
+
+def encode_scalar(value):
+    """JSON for one stored value; plain ints and floats skip json.dumps."""
+    if value is None:
+        return 'null'
+    value_type = type(value)
+    if value_type is int:
+        return int.__repr__(value)
+    if value_type is float and math.isfinite(value):
+        return float.__repr__(value)
+    return json.dumps(value)
+
+STREAM_BATCH_POINTS = 1024
+
+def _encode_point(point):
+    value = point[1]
+    return f'{{"timestamp":{point[0]},"value":{value if type(value) is int else encode_scalar(value)}}}'
+
+def _encode_value(value):
+    return int.__repr__(value) if type(value) is int else encode_scalar(value)
+
+def _json_list(items, encode):
+    """Yields the JSON array elements of `items` in comma-joined batches."""
+    batch = list(islice(items, STREAM_BATCH_POINTS))
+    separator = ''
+    while batch:
+        yield separator + ','.join(map(encode, batch))
+        separator = ','
+        batch = list(islice(items, STREAM_BATCH_POINTS))
+
+def _chunked(parts, chunk_bytes):
+    buffer, size = [], 0
+    for part in parts:
+        buffer.append(part)
+        size += len(part)
+        if size >= chunk_bytes:
+            yield ''.join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield ''.join(buffer)
+
+def _history_parts(conn, kind, member, start_timestamp, columnar):
+    yield '{'
+    separator = ''
+    for name in history_names(conn, kind, member):
+        points = iter_history_points(conn, kind, member, name, start_timestamp)
+        first = next(points, None)
+        if first is None and kind in SERIES_KINDS:
+            continue # Series without a value in range are left out, as in the buffered response.
+        yield separator + json.dumps(name)
+        separator = ','
+        points = chain([first], points) if first is not None else iter(())
+        if columnar:
+            yield ':{"timestamps":['
+            yield from _json_list((point[0] for point in points), int.__repr__)
+            # A second pass over the cursors instead of buffering the timestamps.
+            values = iter_history_points(conn, kind, member, name, start_timestamp) if first is not None else iter(())
+            yield '],"values":['
+            yield from _json_list((point[1] for point in values), _encode_value)
+            yield ']}'
+        else:
+            yield ':['
+            yield from _json_list(points, _encode_point)
+            yield ']'
+    yield '}'
+
+def stream_history(conn, kind, member, start_timestamp, columnar=False, chunk_bytes=STREAM_CHUNK_BYTES):
+    """Yields the raw history of one kind as JSON text in chunks of about `chunk_bytes`.
+
+    The default layout matches the buffered response ({name: [{timestamp, value}]});
+    `columnar` emits {name: {"timestamps": [...], "values": [...]}} instead.
+    All chunks are read inside one transaction, so they describe one snapshot.
+    """
+    conn.execute('BEGIN')
+    try:
+        yield from _chunked(_history_parts(conn, kind, member, start_timestamp, columnar), chunk_bytes)
+    finally:
+        conn.rollback()
@@ -0,0 +1,143 @@
+# hypixel_client.py
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+DEFAULT_BASE_URL = "https://api.hypixel.net"
+DEFAULT_RATE_LIMIT = 120 # requests per window, per API key
+DEFAULT_RATE_WINDOW = 60 # seconds
+
+class RateLimiter:
+    """Thread-safe request budget for one API key.
+
+    Starts from the configured per-key limit and then follows the
+    `RateLimit-Remaining` / `RateLimit-Reset` headers Hypixel sends back,
+    blocking callers until the window resets once the budget is spent.
+    """
+
+    def __init__(self, limit=DEFAULT_RATE_LIMIT, window=DEFAULT_RATE_WINDOW, clock=time.monotonic, sleep=time.sleep):
+        self.limit = limit
+        self.window = window
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._remaining = limit
+        self._reset_at = clock() + window
+
+    def acquire(self):
+        """Blocks until a request may be sent and reserves it."""
+        while True:
+            with self._lock:
+                now = self._clock()
+                if now >= self._reset_at:
+                    self._remaining = self.limit
+                    self._reset_at = now + self.window
+                if self._remaining > 0:
+                    self._remaining -= 1
+                    return
+                wait = self._reset_at - now
+            self._sleep(wait)
+
+    def update(self, headers):
+        """Adopts the server's view of the budget from a response's headers."""
+        try:
+            remaining = int(headers['RateLimit-Remaining'])
+            reset = float(headers['RateLimit-Reset'])
+        except (KeyError, TypeError, ValueError):
+            return
+        with self._lock:
+            if 'RateLimit-Limit' in headers:
+                try:
+                    self.limit = int(headers['RateLimit-Limit'])
+                except ValueError:
+                    pass
+            # Requests still in flight were already deducted locally, so never raise the budget.
+            self._remaining = min(self._remaining, remaining)
+            self._reset_at = self._clock() + reset
+
+    def exhaust(self, retry_after):
+        """Empties the budget for `retry_after` seconds (used after a 429).
+
+        The server's Retry-After wins over the local window, which is only a guess.
+        """
+        with self._lock:
+            self._remaining = 0
+            self._reset_at = self._clock() + retry_after
+
+class HypixelClient:
+    """Fetches Skyblock profiles over one pooled keep-alive session."""
+
+    def __init__(self, api_key, base_url=DEFAULT_BASE_URL, max_workers=8, timeout=10, max_retries=4, rate_limiter=None, session=None):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.session = session or requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({"API-Key": api_key})
+
+    def close(self):
+        self.session.close()
+
+    def fetch_profile(self, profile_id):
+        """Returns the profile dict, or None when the API refuses or keeps failing."""
+        url = f"{self.base_url}/v2/skyblock/profile"
+        for attempt in range(self.max_retries + 1):
+            # No backoff after the last attempt; nothing follows it.
+            last_attempt = attempt == self.max_retries
+            self.rate_limiter.acquire()
+            try:
+                response = self.session.get(url, params={"profile": profile_id}, timeout=self.timeout)
+            except requests.exceptions.RequestException as e:
+                metrics.inc('hypixel_requests_total', status='error')
+                print(f"Request for profile {profile_id} failed: {e}")
+                if not last_attempt:
+                    time.sleep(min(2 ** attempt, 30))
+                continue
+            self.rate_limiter.update(response.headers)
+            metrics.inc('hypixel_requests_total', status=str(response.status_code))
+
+            if response.status_code == 429 or response.status_code >= 500:
+                retry_after = _retry_after(response.headers, default=min(2 ** attempt, 30))
+                if response.status_code == 429:
+                    # Other requests share the budget, so it is exhausted even on the last attempt.
+                    self.rate_limiter.exhaust(retry_after)
+                elif not last_attempt:
+                    time.sleep(retry_after)
+                if not last_attempt:
+                    print(f"Profile {profile_id}: HTTP {response.status_code}, retrying in {retry_after:.0f}s.")
+                continue
+            try:
+                response.raise_for_status()
+                metrics.observe('hypixel_response_bytes', len(response.content))
+                data = response.json()
+            except (requests.exceptions.RequestException, ValueError) as e:
+                print(f"An error occurred for profile {profile_id}: {e}")
+                return None
+            return data.get("profile") if data.get("success") else None
+        print(f"Giving up on profile {profile_id} after {self.max_retries + 1} attempts.")
+        return None
+
+    def fetch_profiles(self, profile_ids):
+        """Fetches several profiles concurrently. Returns {profile_id: profile or None}."""
+        profile_ids = list(dict.fromkeys(profile_ids))
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, max(len(profile_ids), 1))) as pool:
+            return dict(zip(profile_ids, pool.map(self.fetch_profile, profile_ids)))
+
+def _retry_after(headers, default):
+    for header in ('Retry-After', 'RateLimit-Reset'):
+        try:
+            return max(float(headers[header]), 0.0)
+        except (KeyError, TypeError, ValueError):
+            continue
+    return default
@@ -1,13 +1,19 @@
 # hypixel_tracker.py
 
 import json
-import sqlite3
 import time
 import os
-import requests
 import re
+import sqlite3
 from dotenv import load_dotenv
-from skyblock_constants import SKILL_DATA, BESTIARY_THRESHOLDS, BESTIARY_FAMILIES
+from tier_engine import collection_tiers, skill_levels
+from db_schema import connect_database, migrate
+from history import update_rollups
+from snapshot_store import SERIES_TABLES, load_series_state, mark_absent, write_series_rows
+from response_cache import bump_generation
+from raw_archive import ARCHIVE_DIR, archive_response
+import metrics
+from hypixel_client import DEFAULT_BASE_URL, DEFAULT_RATE_LIMIT, DEFAULT_RATE_WINDOW, HypixelClient, RateLimiter
 # NOTE: You must have skyblock_constants.py and collections.json in the same directory.
 
 # --- Configuration ---
@@ -16,172 +22,257 @@ API_KEY = os.getenv("HYPIXEL_API_KEY")
 DATABASE_FILE = 'skyblock_stats.db'
 PLAYER_UUID = "46cd959156324f668005c96d432ddb56"
 PROFILE_ID = "46cd9591-5632-4f66-8005-c96d432ddb56"
+# "delta" stores a series row only when its value changed, "full" stores every value on every run.
+SNAPSHOT_STORAGE = os.getenv("SNAPSHOT_STORAGE", "delta")
+# JSON list of {"profile_id": ..., "member_uuid": ...}; falls back to PROFILE_ID/PLAYER_UUID.
+PROFILES_FILE = os.getenv("PROFILES_FILE", "profiles.json")
+API_BASE_URL = os.getenv("HYPIXEL_API_URL", DEFAULT_BASE_URL)
+API_RATE_LIMIT = int(os.getenv("HYPIXEL_RATE_LIMIT", DEFAULT_RATE_LIMIT))
+API_RATE_WINDOW = int(os.getenv("HYPIXEL_RATE_WINDOW", DEFAULT_RATE_WINDOW))
+FETCH_WORKERS = int(os.getenv("FETCH_WORKERS", 8))
+# Raw responses are kept in RAW_ARCHIVE_DIR for replay_archive.py; set it to "" to disable.
+ARCHIVE_RESPONSES = bool(ARCHIVE_DIR)
 
 # --- Helper Functions ---
 
-def load_collection_data():
-    """Loads the collection thresholds from the collections.json file."""
+def load_tracked_profiles():
+    """Returns {profile_id: set of member UUIDs} for every tracked player."""
     try:
-        with open('collections.json', 'r') as f:
-            return json.load(f)
+        with open(PROFILES_FILE, 'r') as f:
+            entries = json.load(f)
     except FileNotFoundError:
-        print("Warning: collections.json not found.")
-        return {}
+        entries = [{"profile_id": PROFILE_ID, "member_uuid": PLAYER_UUID}]
+    tracked = {}
+    for entry in entries:
+        tracked.setdefault(entry['profile_id'], set()).add(entry['member_uuid'].replace('-', ''))
+    return tracked
 
-COLLECTION_THRESHOLDS = load_collection_data()
-
-def calculate_level(skill_name, xp):
-    """Calculates skill level based on its name and total XP."""
-    thresholds = SKILL_DATA.get(skill_name, SKILL_DATA["standard"])
-    max_level = len(thresholds)
-    if not thresholds or xp is None:
-        return 0
-    if xp >= thresholds[-1]: return max_level
-    level = 0
-    for i, threshold in enumerate(thresholds):
-        if xp >= threshold: level = i + 1
-        else: break
-    return level
-
-def calculate_tier(collection_name, amount):
-    """Calculates collection tier based on its name and amount collected."""
-    thresholds = COLLECTION_THRESHOLDS.get(collection_name.upper())
-    if not thresholds or amount is None: return 0
-    max_tier = len(thresholds)
-    if amount >= thresholds[-1]: return max_tier
-    tier = 0
-    for i, threshold in enumerate(thresholds):
-        if amount >= threshold: tier = i + 1
-        else: break
-    return tier
-
-def fetch_hypixel_data(api_key, profile_id):
+def create_client(api_key):
+    """Builds the pooled, rate-limited API client used for a collection run."""
+    return HypixelClient(api_key, base_url=API_BASE_URL, max_workers=FETCH_WORKERS,
+                         rate_limiter=RateLimiter(API_RATE_LIMIT, API_RATE_WINDOW))
+
+def fetch_hypixel_data(api_key, profile_id, client=None):
     """Fetches Skyblock profile data from the Hypixel API."""
     if not api_key:
         print("Error: HYPIXEL_API_KEY not found in .env file.")
         return None
-    url = f"https://api.hypixel.net/v2/skyblock/profile?profile={profile_id}"
-    headers = {"API-Key": api_key}
     print(f"Fetching data from Hypixel API for profile: {profile_id}")
+    if client is not None:
+        return client.fetch_profile(profile_id)
+    client = create_client(api_key)
     try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        data = response.json()
-        return data.get("profile") if data.get("success") else None
-    except requests.exceptions.RequestException as e:
-        print(f"An error occurred: {e}")
-        return None
+        return client.fetch_profile(profile_id)
+    finally:
+        client.close()
 
-def create_database_schema(cursor):
-    """Creates all necessary tables in the SQLite database."""
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS profile_snapshots (
-            profile_id TEXT NOT NULL, member_uuid TEXT NOT NULL, snapshot_timestamp INTEGER NOT NULL,
-            cute_name TEXT, purse REAL, death_count INTEGER, kills INTEGER, bank_balance REAL,
-            PRIMARY KEY (profile_id, member_uuid, snapshot_timestamp)
-        )
-    ''')
+def fetch_all_profiles(api_key, profile_ids, client=None):
+    """Fetches every tracked profile concurrently. Returns {profile_id: profile or None}."""
+    if not api_key:
+        print("Error: HYPIXEL_API_KEY not found in .env file.")
+        return {}
+    print(f"Fetching {len(profile_ids)} profile(s) from the Hypixel API.")
+    if client is not None:
+        return client.fetch_profiles(profile_ids)
+    client = create_client(api_key)
     try:
-        cursor.execute('ALTER TABLE profile_snapshots ADD COLUMN bank_balance REAL')
-    except sqlite3.OperationalError:
-        pass # Column already exists
-
-    cursor.execute('''CREATE TABLE IF NOT EXISTS skill_snapshots (snapshot_id INTEGER PRIMARY KEY, member_uuid TEXT, profile_id TEXT, snapshot_timestamp INTEGER, skill_name TEXT, total_xp REAL, level INTEGER, FOREIGN KEY (profile_id, member_uuid, snapshot_timestamp) REFERENCES profile_snapshots (profile_id, member_uuid, snapshot_timestamp))''')
-    cursor.execute('''CREATE TABLE IF NOT EXISTS slayer_snapshots (snapshot_id INTEGER PRIMARY KEY, member_uuid TEXT, profile_id TEXT, snapshot_timestamp INTEGER, slayer_name TEXT, total_xp INTEGER, tier1_kills INTEGER, tier2_kills INTEGER, tier3_kills INTEGER, tier4_kills INTEGER, tier5_kills INTEGER, FOREIGN KEY (profile_id, member_uuid, snapshot_timestamp) REFERENCES profile_snapshots (profile_id, member_uuid, snapshot_timestamp))''')
-    cursor.execute('''CREATE TABLE IF NOT EXISTS collection_snapshots (snapshot_id INTEGER PRIMARY KEY, member_uuid TEXT, profile_id TEXT, snapshot_timestamp INTEGER, collection_name TEXT, amount INTEGER, tier INTEGER, FOREIGN KEY (profile_id, member_uuid, snapshot_timestamp) REFERENCES profile_snapshots (profile_id, member_uuid, snapshot_timestamp))''')
-    cursor.execute('''CREATE TABLE IF NOT EXISTS bank_transactions (transaction_id INTEGER PRIMARY KEY, profile_id TEXT, timestamp INTEGER UNIQUE, action TEXT, amount REAL, initiator_name TEXT)''')
-    cursor.execute('''CREATE TABLE IF NOT EXISTS bestiary_snapshots (snapshot_id INTEGER PRIMARY KEY, member_uuid TEXT, profile_id TEXT, snapshot_timestamp INTEGER, mob_id TEXT, kills INTEGER, UNIQUE(profile_id, member_uuid, snapshot_timestamp, mob_id))''')
-    print("Database schema created or verified successfully.")
-
-def parse_and_insert_data(cursor, data, snapshot_timestamp):
-    """Parses the JSON data and inserts it into the SQLite database tables."""
-    if not data: return
+        return client.fetch_profiles(profile_ids)
+    finally:
+        client.close()
+
+def create_database_schema(cursor):
+    """Creates all necessary tables and brings the schema up to the current version."""
+    version = migrate(cursor.connection)
+    print(f"Database schema created or verified successfully (version {version}).")
+
+# Trailing _<numbers> on bestiary ids, e.g. 'arachne_300' and 'zombie_1'.
+MOB_LEVEL_SUFFIX = re.compile(r'_\d+$')
+_base_mob_ids = {}
+
+def normalize_mob_id(api_mob_id):
+    """Strips the level suffix so 'arachne_300' and 'zombie_1' group into 'arachne' and 'zombie'."""
+    base_mob_id = _base_mob_ids.get(api_mob_id)
+    if base_mob_id is None:
+        base_mob_id = _base_mob_ids[api_mob_id] = MOB_LEVEL_SUFFIX.sub('', api_mob_id)
+    return base_mob_id
+
+def new_row_batches():
+    """Empty per-table row lists, in the order they are flushed."""
+    return {'bank_transactions': [], 'profile_snapshots': [], **{table: [] for table in SERIES_TABLES}}
+
+def build_row_batches(data, snapshot_timestamp, member_uuids=None, batches=None):
+    """Parses one profile's JSON into per-table row lists without touching the database.
+
+    Only the members in `member_uuids` are included (default: PLAYER_UUID).
+    Rows are appended to `batches` when given, so several profiles can share one flush.
+    """
+    batches = batches if batches is not None else new_row_batches()
+    if not data: return batches
+    member_uuids = member_uuids or {PLAYER_UUID}
     profile_id = data.get('profile_id')
     bank_balance = data.get('banking', {}).get('balance', 0)
 
-    if 'banking' in data and 'transactions' in data['banking']:
-        for tx in data['banking']['transactions']:
-            cursor.execute('INSERT OR IGNORE INTO bank_transactions VALUES (NULL, ?, ?, ?, ?, ?)', (profile_id, tx.get('timestamp'), tx.get('action'), tx.get('amount'), tx.get('initiator_name')))
-        print(f"Processed {len(data['banking']['transactions'])} bank transactions.")
+    transactions = data.get('banking', {}).get('transactions', [])
+    batches['bank_transactions'].extend((profile_id, tx.get('timestamp'), tx.get('action'), tx.get('amount'), tx.get('initiator_name')) for tx in transactions)
 
     for member_uuid, member_data in data.get('members', {}).items():
-        if member_uuid != PLAYER_UUID: continue
-        print(f"\nProcessing member: {member_uuid}")
+        if member_uuid not in member_uuids: continue
         purse_amount = member_data.get('currencies', {}).get('coin_purse', 0)
         death_count = member_data.get('death_count', 0)
-        
+
         raw_total_kills = member_data.get('player_stats', {}).get('kills', 0)
         total_kill_count = sum(raw_total_kills.values()) if isinstance(raw_total_kills, dict) else raw_total_kills
 
-        cursor.execute('INSERT OR IGNORE INTO profile_snapshots VALUES (?, ?, ?, ?, ?, ?, ?, ?)', 
-                       (profile_id, member_uuid, snapshot_timestamp, data.get('cute_name', 'N/A'), purse_amount, death_count, total_kill_count, bank_balance))
-        print(f"  - Added entry to profile_snapshots.")
-        
-        experience_data = member_data.get('experience', {})
-        if experience_data:
-            skills = {k.replace('SKILL_', '').lower(): v for k, v in experience_data.items()}
-            for skill_name, xp in skills.items():
-                current_level = calculate_level(skill_name, xp)
-                cursor.execute('INSERT OR IGNORE INTO skill_snapshots VALUES (NULL, ?, ?, ?, ?, ?, ?)', (member_uuid, profile_id, snapshot_timestamp, skill_name, xp, current_level))
-            print(f"  - Processed {len(skills)} skills.")
+        batches['profile_snapshots'].append((profile_id, member_uuid, snapshot_timestamp, data.get('cute_name', 'N/A'), purse_amount, death_count, total_kill_count, bank_balance))
+        key = (profile_id, member_uuid, snapshot_timestamp)
+
+        experience_data = {k.replace('SKILL_', '').lower(): v for k, v in member_data.get('experience', {}).items()}
+        levels = skill_levels(experience_data)
+        batches['skill_snapshots'].extend(key + (skill_name, xp, levels[skill_name]) for skill_name, xp in experience_data.items())
 
         slayers = member_data.get('slayer', {}).get('slayer_bosses', {})
-        if slayers:
-            for name, s_data in slayers.items():
-                if 'xp' not in s_data: continue
-                cursor.execute('INSERT OR IGNORE INTO slayer_snapshots VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', (member_uuid, profile_id, snapshot_timestamp, name, s_data.get('xp', 0), s_data.get('boss_kills_tier_0', 0), s_data.get('boss_kills_tier_1', 0), s_data.get('boss_kills_tier_2', 0), s_data.get('boss_kills_tier_3', 0), s_data.get('boss_kills_tier_4', 0)))
-            print(f"  - Processed {len(slayers)} slayers.")
-        
+        batches['slayer_snapshots'].extend(
+            key + (name, s_data.get('xp', 0), s_data.get('boss_kills_tier_0', 0), s_data.get('boss_kills_tier_1', 0), s_data.get('boss_kills_tier_2', 0), s_data.get('boss_kills_tier_3', 0), s_data.get('boss_kills_tier_4', 0))
+            for name, s_data in slayers.items() if 'xp' in s_data)
+
         collections = member_data.get('collection', {})
-        if collections:
-            for name, amount in collections.items():
-                current_tier = calculate_tier(name, amount)
-                cursor.execute('INSERT OR IGNORE INTO collection_snapshots VALUES (NULL, ?, ?, ?, ?, ?, ?)', (member_uuid, profile_id, snapshot_timestamp, name.upper(), amount, current_tier))
-            print(f"  - Processed {len(collections)} collections.")
-
-        bestiary_data = member_data.get('bestiary', {})
-        if bestiary_data:
-            api_mob_kills = bestiary_data.get('kills', {})
-            aggregated_kills = {}
-            
-            for api_mob_id, kills in api_mob_kills.items():
-                try:
-                    current_kills = int(kills or 0)
-                    
-                    # Normalize the API mob ID by removing trailing _<numbers>
-                    # This correctly groups 'arachne_300' and 'zombie_1' into 'arachne' and 'zombie'
-                    base_mob_id = re.sub(r'_\d+$', '', api_mob_id)
-                    
-                    # Aggregate kills under the normalized base ID
-                    aggregated_kills[base_mob_id] = aggregated_kills.get(base_mob_id, 0) + current_kills
-                except (ValueError, TypeError):
-                    print(f"  - Warning: Skipping bestiary entry with non-integer kill count. ID: {api_mob_id}, Value: {kills}")
-                    continue
-
-            for base_mob_id, total_kills in aggregated_kills.items():
-                # Store the normalized base_mob_id in the database
-                cursor.execute('INSERT OR IGNORE INTO bestiary_snapshots VALUES (NULL, ?, ?, ?, ?, ?)', 
-                               (member_uuid, profile_id, snapshot_timestamp, base_mob_id, total_kills))
-            print(f"  - Aggregated and processed {len(aggregated_kills)} bestiary entries.")
+        tiers = collection_tiers(collections)
+        batches['collection_snapshots'].extend(key + (name.upper(), amount, tiers[name]) for name, amount in collections.items())
 
+        api_mob_kills = member_data.get('bestiary', {}).get('kills', {})
+        aggregated_kills = {}
+        for api_mob_id, kills in api_mob_kills.items():
+            try:
+                current_kills = int(kills or 0)
+            except (ValueError, TypeError):
+                print(f"  - Warning: Skipping bestiary entry with non-integer kill count. ID: {api_mob_id}, Value: {kills}")
+                continue
+            # Aggregate kills under the normalized base ID
+            base_mob_id = normalize_mob_id(api_mob_id)
+            aggregated_kills[base_mob_id] = aggregated_kills.get(base_mob_id, 0) + current_kills
+        batches['bestiary_snapshots'].extend(key + item for item in aggregated_kills.items())
+    return batches
 
-def main():
-    """Main function to run the script."""
-    profile_data = fetch_hypixel_data(API_KEY, PROFILE_ID)
-    if not profile_data:
+def flush_row_batches(cursor, batches, state=None, record_state=True, snapshots=None):
+    """Writes row batches with one executemany per table. Returns {table: rows written}.
+
+    Series rows go through the change-only filter unless SNAPSHOT_STORAGE is "full".
+    Series missing from one of `snapshots` (default: the member snapshots in
+    `batches`) are marked absent; pass () when the rows are already filtered.
+    `record_state` is passed on to write_series_rows(). The caller owns the transaction.
+    """
+    state = state if state is not None else load_series_state(cursor)
+    full_copy = SNAPSHOT_STORAGE == 'full'
+    written = {}
+    # INSERT OR IGNORE skips rows already stored; total_changes counts only the inserts.
+    changes = cursor.connection.total_changes
+    cursor.executemany('INSERT OR IGNORE INTO bank_transactions (profile_id, timestamp, action, amount, initiator_name) VALUES (?, ?, ?, ?, ?)', batches['bank_transactions'])
+    written['bank_transactions'], changes = cursor.connection.total_changes - changes, cursor.connection.total_changes
+    cursor.executemany('INSERT OR IGNORE INTO profile_snapshots (profile_id, member_uuid, snapshot_timestamp, cute_name, purse, death_count, kills, bank_balance) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', batches['profile_snapshots'])
+    written['profile_snapshots'] = cursor.connection.total_changes - changes
+    if snapshots is None:
+        snapshots = [row[:3] for row in batches['profile_snapshots']]
+    for table in SERIES_TABLES:
+        # Primary-key order keeps the B-tree inserts sequential.
+        rows = mark_absent(state, table, sorted(batches[table], key=lambda row: row[:4]), snapshots)
+        written[table] = write_series_rows(cursor, state, table, rows, full_copy, record_state)
+    return written
+
+def parse_and_insert_data(cursor, data, snapshot_timestamp, member_uuids=None):
+    """Parses the JSON data and inserts it into the SQLite database tables.
+
+    Only the members in `member_uuids` are stored (default: PLAYER_UUID).
+    """
+    if not data: return
+    batches = build_row_batches(data, snapshot_timestamp, member_uuids)
+    written = flush_row_batches(cursor, batches)
+    for table, rows in batches.items():
+        print(f"  - {table}: {len(rows)} parsed, {written[table]} written.")
+
+def archive_fetched(fetched, tracked, snapshot_timestamp):
+    """Stores this run's raw responses before parsing them. Failures only warn."""
+    try:
+        new_objects = sum(archive_response(profile_id, snapshot_timestamp, data, tracked[profile_id])[1] for profile_id, data in fetched.items())
+        print(f"Archived {len(fetched)} raw response(s) ({new_objects} new) in '{ARCHIVE_DIR}'.")
+    except OSError as e:
+        print(f"Warning: could not archive raw responses: {e}")
+
+def store_snapshot(conn, fetched, tracked, snapshot_timestamp, state=None):
+    """Parses {profile_id: profile} and commits it as one snapshot, rollups included.
+
+    Returns ({table: rows parsed}, {table: rows written}).
+    """
+    cursor = conn.cursor()
+    batches = new_row_batches()
+    with metrics.timed('collector_phase_duration_seconds', phase='parse'):
+        for profile_id, profile_data in fetched.items():
+            build_row_batches(profile_data, snapshot_timestamp, tracked[profile_id], batches)
+    # Every profile of this run lands in one transaction under one snapshot timestamp.
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        with metrics.timed('collector_phase_duration_seconds', phase='insert'):
+            written = flush_row_batches(cursor, batches, state)
+        with metrics.timed('collector_phase_duration_seconds', phase='rollup'):
+            update_rollups(cursor, snapshot_timestamp)
+        with metrics.timed('collector_phase_duration_seconds', phase='commit'):
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    parsed = {table: len(rows) for table, rows in batches.items()}
+    for table, rows in parsed.items():
+        metrics.inc('collector_rows_parsed_total', rows, table=table)
+        metrics.inc('collector_rows_written_total', written.get(table, 0), table=table)
+    return parsed, written
+
+def collect(conn, client=None):
+    """Fetches every tracked profile and commits them as one snapshot.
+
+    `conn` must already be migrated (create_database_schema). Returns
+    {"snapshot_timestamp", "profiles", "written"}, or None when no profile
+    could be fetched. Database errors propagate to the caller.
+    """
+    tracked = load_tracked_profiles()
+    with metrics.timed('collector_phase_duration_seconds', phase='fetch'):
+        profiles = fetch_all_profiles(API_KEY, list(tracked), client)
+    fetched = {profile_id: data for profile_id, data in profiles.items() if data}
+    for profile_id in tracked:
+        if profile_id not in fetched:
+            print(f"Warning: no data for profile {profile_id}, skipping it this run.")
+    if not fetched:
         print("Halting execution due to API fetch failure.")
-        return
+        metrics.inc('collector_runs_total', outcome='no_data')
+        return None
     snapshot_timestamp = int(time.time())
     print(f"\nUsing snapshot timestamp: {snapshot_timestamp}")
+    if ARCHIVE_RESPONSES:
+        with metrics.timed('collector_phase_duration_seconds', phase='archive'):
+            archive_fetched(fetched, tracked, snapshot_timestamp)
 
     try:
-        conn = sqlite3.connect(DATABASE_FILE)
+        parsed, written = store_snapshot(conn, fetched, tracked, snapshot_timestamp)
+    except Exception:
+        metrics.inc('collector_runs_total', outcome='failed')
+        raise
+    metrics.inc('collector_runs_total', outcome='succeeded')
+    try:
+        bump_generation(DATABASE_FILE, snapshot_timestamp)
+    except (OSError, sqlite3.Error) as e:
+        # The snapshot is committed; cached responses just stay stale until the next run.
+        print(f"Warning: could not invalidate cached responses: {e}")
+    for table, rows in written.items():
+        print(f"  - {table}: {parsed[table]} parsed, {rows} written.")
+    print("\nAll data has been successfully committed to the database.")
+    return {"snapshot_timestamp": snapshot_timestamp, "profiles": len(fetched), "written": written}
+
+def main():
+    """Main function to run the script."""
+    try:
+        conn = connect_database(DATABASE_FILE)
         cursor = conn.cursor()
         print(f"Successfully connected to database '{DATABASE_FILE}'.")
         create_database_schema(cursor)
-        parse_and_insert_data(cursor, profile_data, snapshot_timestamp)
-        conn.commit()
-        print("\nAll data has been successfully committed to the database.")
+        collect(conn)
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
     finally:
@@ -0,0 +1,447 @@
+# metrics.py
+
+import atexit
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+from bisect import bisect_left
+from collections import Counter
+from itertools import count
+from operator import itemgetter
+
+# Prometheus metrics for the API and the collector, without a client library.
+# Every process (each gunicorn worker, the collector process, one-off scripts)
+# accumulates counters and histograms in memory, and a background thread adds
+# them to a small SQLite file shared by all of them every FLUSH_INTERVAL
+# seconds. /metrics renders the sums, so a scrape sees every process no matter
+# which worker answers it, and totals survive worker restarts.
+#
+# Slow requests can additionally be profiled: with PROFILE_SLOW_REQUEST_MS
+# set, the stacks of in-flight requests are sampled and written as folded
+# stacks (flamegraph.pl, speedscope) for every request slower than that.
+
+METRICS_FILE = os.getenv("METRICS_FILE", "metrics.db") # "" disables metrics
+FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", 5))
+PROFILE_SLOW_REQUEST_MS = float(os.getenv("PROFILE_SLOW_REQUEST_MS", 0)) # 0 disables profiling
+PROFILE_DIR = os.getenv("PROFILE_DIR", "slow_requests")
+PROFILE_SAMPLE_INTERVAL = 0.005 # seconds
+MAX_QUERY_LABELS = 64 # distinct statements tracked per process; the rest count as "other"
+ENABLED = bool(METRICS_FILE)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+PHASE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+# name -> (type, help, histogram buckets)
+METRICS = {
+    'http_request_duration_seconds': ('histogram', "Time to answer an API request, streamed bodies included.", LATENCY_BUCKETS),
+    'http_slow_requests_profiled_total': ('counter', "Requests slower than PROFILE_SLOW_REQUEST_MS whose stacks were written out.", None),
+    'sqlite_query_duration_seconds': ('histogram', "Time spent executing a statement and fetching its rows, by verb and first table (query) and CRC32 of the normalized SQL (query_id).", LATENCY_BUCKETS),
+    'sqlite_query_rows_total': ('counter', "Rows returned by a statement (rows changed, for executemany).", None),
+    'collector_runs_total': ('counter', "Collection runs by outcome.", None),
+    'collector_phase_duration_seconds': ('histogram', "Time spent in each phase of a collection run.", PHASE_BUCKETS),
+    'collector_rows_parsed_total': ('counter', "Rows parsed from fetched profiles, per table.", None),
+    'collector_rows_written_total': ('counter', "Rows actually written (after change-only filtering), per table.", None),
+    'hypixel_requests_total': ('counter', "Hypixel API requests by HTTP status (\"error\" when no response arrived).", None),
+    'hypixel_response_bytes': ('histogram', "Size of each Hypixel API response body.", SIZE_BUCKETS),
+}
+
+# --- Recording ---
+
+class Registry:
+    """This process's metric deltas since the last flush to the shared file."""
+
+    def __init__(self, path=METRICS_FILE, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._flusher = None
+        self._conn = None
+        self._conn_lock = threading.Lock()
+
+    def _reset_after_fork(self):
+        # The parent flushes what it recorded; the child starts empty.
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._flusher = None
+        self._conn = None
+        self._conn_lock = threading.Lock()
+
+    def inc(self, name, labels=(), amount=1):
+        key = (name, labels)
+        with self._lock:
+            self._pending[key] = self._pending.get(key, 0) + amount
+            if self._flusher is None:
+                self._start_flusher()
+
+    def observe(self, name, labels, value):
+        key = (name, labels)
+        buckets = METRICS[name][2]
+        with self._lock:
+            histogram = self._pending.get(key)
+            if histogram is None:
+                # Per-bucket counts (the last one is +Inf), then sum and count.
+                histogram = self._pending[key] = [0] * (len(buckets) + 3)
+                if self._flusher is None:
+                    self._start_flusher()
+            histogram[bisect_left(buckets, value)] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def _start_flusher(self):
+        self._flusher = threading.Thread(target=self._flush_periodically, name='metrics-flush', daemon=True)
+        self._flusher.start()
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def _shared(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=1, check_same_thread=False, isolation_level=None)
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = OFF')
+            conn.execute('CREATE TABLE IF NOT EXISTS samples (name TEXT NOT NULL, labels TEXT NOT NULL, sample TEXT NOT NULL, value REAL NOT NULL, PRIMARY KEY (name, labels, sample)) WITHOUT ROWID')
+            self._conn = conn
+        return self._conn
+
+    def flush(self):
+        """Adds the pending deltas to the shared file; kept for the next try if it is busy."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        rows = []
+        for (name, labels), value in pending.items():
+            label_text = format_labels(labels)
+            if METRICS[name][0] == 'counter':
+                rows.append((name, label_text, '', value))
+                continue
+            buckets = METRICS[name][2]
+            rows += [(name, label_text, f'le={_format_number(bound)}', count) for bound, count in zip(buckets + (float('inf'),), value) if count]
+            rows += [(name, label_text, 'sum', value[-2]), (name, label_text, 'count', value[-1])]
+        try:
+            with self._conn_lock:
+                conn = self._shared()
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    conn.executemany('INSERT INTO samples (name, labels, sample, value) VALUES (?, ?, ?, ?) '
+                                     'ON CONFLICT (name, labels, sample) DO UPDATE SET value = value + excluded.value', rows)
+                    conn.execute('COMMIT')
+                except sqlite3.Error:
+                    conn.execute('ROLLBACK')
+                    raise
+        except sqlite3.Error:
+            with self._lock:
+                for key, value in pending.items():
+                    self._merge(key, value)
+
+    def _merge(self, key, value):
+        current = self._pending.get(key)
+        if current is None:
+            self._pending[key] = value
+        elif isinstance(value, list):
+            self._pending[key] = [a + b for a, b in zip(current, value)]
+        else:
+            self._pending[key] = current + value
+
+    def samples(self):
+        """Every (name, labels, sample, value) summed over all processes."""
+        self.flush()
+        try:
+            with self._conn_lock:
+                return self._shared().execute('SELECT name, labels, sample, value FROM samples ORDER BY name, labels').fetchall()
+        except sqlite3.Error:
+            return []
+
+registry = Registry()
+if ENABLED:
+    os.register_at_fork(after_in_child=registry._reset_after_fork)
+    atexit.register(registry.flush)
+
+def inc(name, amount=1, **labels):
+    if ENABLED:
+        registry.inc(name, tuple(sorted(labels.items())), amount)
+
+def observe(name, value, **labels):
+    if ENABLED:
+        registry.observe(name, tuple(sorted(labels.items())), value)
+
+class timed:
+    """Context manager observing its duration in the histogram `name`."""
+
+    def __init__(self, name, **labels):
+        self.name = name
+        self.labels = tuple(sorted(labels.items()))
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if ENABLED:
+            registry.observe(self.name, self.labels, time.perf_counter() - self.started)
+
+# --- Exposition ---
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(int(value)) if float(value).is_integer() else repr(float(value))
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(labels):
+    return ','.join(f'{key}="{_escape(value)}"' for key, value in labels)
+
+def _series(name, label_text, le=None):
+    labels = ','.join(filter(None, (label_text, f'le="{le}"' if le is not None else '')))
+    return f'{name}{{{labels}}}' if labels else name
+
+def render():
+    """The Prometheus text format of every metric, summed over all processes."""
+    grouped = {}
+    for name, label_text, sample, value in registry.samples():
+        if name in METRICS:
+            grouped.setdefault(name, {}).setdefault(label_text, {})[sample] = value
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+        for label_text, values in grouped.get(name, {}).items():
+            if kind == 'counter':
+                lines.append(f"{_series(name, label_text)} {_format_number(values.get('', 0))}")
+                continue
+            cumulative = 0
+            for bound in buckets:
+                le = _format_number(bound)
+                cumulative += values.get(f'le={le}', 0)
+                lines.append(f"{_series(name + '_bucket', label_text, le)} {_format_number(cumulative)}")
+            lines.append(f"{_series(name + '_bucket', label_text, '+Inf')} {_format_number(values.get('count', 0))}")
+            lines.append(f"{_series(name + '_sum', label_text)} {_format_number(values.get('sum', 0))}")
+            lines.append(f"{_series(name + '_count', label_text)} {_format_number(values.get('count', 0))}")
+    return '\n'.join(lines) + '\n'
+
+# --- SQLite instrumentation ---
+
+_query_labels = {}
+_first = itemgetter(0)
+_cursor_next = sqlite3.Cursor.__next__
+
+_STATEMENT_TABLE = re.compile(r'\b(?:FROM|INTO|UPDATE|TABLE)\s+(\w+)', re.IGNORECASE)
+
+def query_id(sql):
+    """The query_id label of a statement: CRC32 of its whitespace-normalized text."""
+    return f"{zlib.crc32(' '.join(sql.split()).encode()):08x}"
+
+def _query_label(sql):
+    label = _query_labels.get(sql)
+    if label is None:
+        if len(_query_labels) >= MAX_QUERY_LABELS:
+            label = (('query', 'other'), ('query_id', 'other'))
+        else:
+            words = sql.split(None, 1)
+            table = _STATEMENT_TABLE.search(sql)
+            name = ' '.join(filter(None, (words[0].lower() if words else '', table.group(1) if table else '')))
+            label = (('query', name), ('query_id', query_id(sql)))
+        _query_labels[sql] = label
+    return label
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Records each statement's execute and fetch time, and the rows it returned,
+    once the statement is done with (re-executed, exhausted by a fetch, closed or
+    collected)."""
+
+    _labels = None
+    _iterated = None
+
+    def _finish(self):
+        labels = self._labels
+        if labels is not None:
+            self._labels = None
+            rows = self._rows
+            if self._iterated is not None:
+                rows += next(self._iterated)
+                self._iterated = None
+            registry.observe('sqlite_query_duration_seconds', labels, self._seconds)
+            registry.inc('sqlite_query_rows_total', labels, rows)
+
+    def execute(self, sql, parameters=()):
+        self._finish()
+        started = time.perf_counter()
+        super().execute(sql, parameters)
+        self._labels, self._seconds, self._rows = _query_label(sql), time.perf_counter() - started, 0
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        self._finish()
+        started = time.perf_counter()
+        super().executemany(sql, seq_of_parameters)
+        self._labels, self._seconds, self._rows = _query_label(sql), time.perf_counter() - started, max(self.rowcount, 0)
+        self._finish()
+        return self
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        if self._labels is not None:
+            self._seconds += time.perf_counter() - started
+            if row is None:
+                self._finish()
+            else:
+                self._rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        if self._labels is not None:
+            self._seconds += time.perf_counter() - started
+            self._rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        if self._labels is not None:
+            self._seconds += time.perf_counter() - started
+            self._rows += len(rows)
+            self._finish()
+        return rows
+
+    def __iter__(self):
+        # Timing every step would cost more than the step itself, so iterated
+        # statements are timed by their execute() call only. Rows are counted
+        # in C by zipping them with a counter; a Python-level __next__ would
+        # slow long history scans down by a fifth.
+        if self._labels is None:
+            return self
+        if self._iterated is None:
+            self._iterated = count()
+        return map(_first, zip(iter(_cursor_next.__get__(self), None), self._iterated))
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        try:
+            self._finish()
+        except Exception:
+            pass # Module globals may already be gone at interpreter shutdown.
+
+class InstrumentedConnection(sqlite3.Connection):
+    """sqlite3 connection whose cursors are InstrumentedCursors."""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+# Pass as sqlite3.connect(..., factory=CONNECTION_FACTORY).
+CONNECTION_FACTORY = InstrumentedConnection if ENABLED else sqlite3.Connection
+
+# --- Slow request profiling ---
+
+def _fold(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+class SlowRequestProfiler:
+    """Samples the stacks of in-flight requests from one background thread."""
+
+    def __init__(self, interval=PROFILE_SAMPLE_INTERVAL):
+        self.interval = interval
+        self._active = {}
+        self._thread = None
+        self._pid = None
+
+    def begin(self):
+        ident = threading.get_ident()
+        self._active[ident] = Counter()
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._sample, name='slow-request-profiler', daemon=True)
+            self._thread.start()
+        return ident
+
+    def end(self, ident):
+        """Stops sampling the request; returns its {folded stack: samples}."""
+        return self._active.pop(ident, None) or Counter()
+
+    def _sample(self):
+        while True:
+            time.sleep(self.interval)
+            if not self._active:
+                continue
+            frames = sys._current_frames()
+            for ident, stacks in list(self._active.items()):
+                frame = frames.get(ident)
+                if frame is not None:
+                    stacks[_fold(frame)] += 1
+
+def write_profile(route, seconds, stacks, profile_dir=PROFILE_DIR):
+    """Default slow-request hook: writes the folded stacks to PROFILE_DIR."""
+    os.makedirs(profile_dir, exist_ok=True)
+    slug = route.strip('/').replace('/', '_').replace('<', '').replace('>', '').replace(':', '-') or 'root'
+    path = os.path.join(profile_dir, f"{int(time.time())}-{os.getpid()}-{slug}-{seconds * 1000:.0f}ms.folded")
+    with open(path, 'w') as f:
+        for stack, count in stacks.most_common():
+            f.write(f"{stack} {count}\n")
+    print(f"Slow request {route} took {seconds * 1000:.0f} ms; {sum(stacks.values())} stack sample(s) written to '{path}'.")
+
+# --- Flask integration ---
+
+def instrument_app(app, profile_slow_ms=PROFILE_SLOW_REQUEST_MS, on_slow_request=write_profile):
+    """Times every request by route, method and status.
+
+    The time is taken when the response is closed, so streamed bodies count.
+    With `profile_slow_ms`, requests slower than that are passed to
+    `on_slow_request(route, seconds, stacks)`.
+    """
+    from flask import g, request
+
+    if not ENABLED:
+        return
+    profiler = SlowRequestProfiler() if profile_slow_ms > 0 else None
+
+    @app.before_request
+    def start_timer():
+        g.metrics_started = time.perf_counter()
+        g.metrics_profile = profiler.begin() if profiler else None
+
+    @app.after_request
+    def record_request(response):
+        started = g.get('metrics_started')
+        if started is None:
+            return response
+        route = request.url_rule.rule if request.url_rule is not None else '<unmatched>'
+        labels = (('method', request.method), ('route', route), ('status', str(response.status_code)))
+        profile = g.get('metrics_profile')
+
+        def finished():
+            seconds = time.perf_counter() - started
+            registry.observe('http_request_duration_seconds', labels, seconds)
+            if profile is not None:
+                stacks = profiler.end(profile)
+                if seconds * 1000 >= profile_slow_ms and stacks:
+                    registry.inc('http_slow_requests_profiled_total', (('route', route),))
+                    on_slow_request(route, seconds, stacks)
+
+        response.call_on_close(finished)
+        return response
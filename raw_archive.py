@@ -0,0 +1,71 @@
+# raw_archive.py
+
+import hashlib
+import json
+import os
+import time
+import zlib
+
+# Every profile the collector fetches is kept here so new tables can be
+# backfilled later (see replay_archive.py) without re-fetching anything.
+#
+#   objects/<2 hex>/<sha256>.json.z   zlib-compressed canonical JSON, stored once per distinct payload
+#   index/<YYYY-MM>.tsv               one line per fetch: snapshot_timestamp, profile_id, sha256, member uuids
+#
+# Index files are the archive's shards: one per UTC month, appended in time order.
+
+ARCHIVE_DIR = os.getenv("RAW_ARCHIVE_DIR", "raw_archive")
+COMPRESSION_LEVEL = 6
+
+def encode_payload(data):
+    """Canonical JSON bytes of a payload, so equal profiles hash equally."""
+    return json.dumps(data, sort_keys=True, separators=(',', ':')).encode()
+
+def object_path(digest, archive_dir=ARCHIVE_DIR):
+    return os.path.join(archive_dir, 'objects', digest[:2], f"{digest}.json.z")
+
+def shard_name(snapshot_timestamp):
+    return time.strftime('%Y-%m', time.gmtime(snapshot_timestamp))
+
+def archive_response(profile_id, snapshot_timestamp, data, member_uuids, archive_dir=ARCHIVE_DIR):
+    """Stores one fetched profile. Returns (sha256, whether a new object was written)."""
+    payload = encode_payload(data)
+    digest = hashlib.sha256(payload).hexdigest()
+    path = object_path(digest, archive_dir)
+    is_new = not os.path.exists(path)
+    if is_new:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(zlib.compress(payload, COMPRESSION_LEVEL))
+        os.replace(tmp_path, path)
+    index_dir = os.path.join(archive_dir, 'index')
+    os.makedirs(index_dir, exist_ok=True)
+    # The object exists before its index line, so a crash never leaves a dangling entry.
+    with open(os.path.join(index_dir, f"{shard_name(snapshot_timestamp)}.tsv"), 'a') as f:
+        f.write(f"{snapshot_timestamp}\t{profile_id}\t{digest}\t{','.join(sorted(member_uuids))}\n")
+    return digest, is_new
+
+def load_payload(digest, archive_dir=ARCHIVE_DIR):
+    with open(object_path(digest, archive_dir), 'rb') as f:
+        return json.loads(zlib.decompress(f.read()))
+
+def list_shards(archive_dir=ARCHIVE_DIR):
+    """Shard names (YYYY-MM), oldest first."""
+    try:
+        names = os.listdir(os.path.join(archive_dir, 'index'))
+    except FileNotFoundError:
+        return []
+    return sorted(name[:-4] for name in names if name.endswith('.tsv'))
+
+def read_index(shard, archive_dir=ARCHIVE_DIR):
+    """Returns a shard's entries as (snapshot_timestamp, profile_id, sha256, member uuid set), oldest first."""
+    entries = []
+    with open(os.path.join(archive_dir, 'index', f"{shard}.tsv")) as f:
+        for line in f:
+            parts = line.rstrip('\n').split('\t')
+            if len(parts) != 4:
+                continue # A torn last line from an interrupted run.
+            entries.append((int(parts[0]), parts[1], parts[2], set(filter(None, parts[3].split(',')))))
+    entries.sort(key=lambda entry: entry[0])
+    return entries
@@ -0,0 +1,247 @@
+# replay_archive.py
+
+import argparse
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby
+
+from db_schema import connect_database
+from history import rebuild_rollups, update_rollups
+from hypixel_tracker import DATABASE_FILE, SNAPSHOT_STORAGE, build_row_batches, create_database_schema, flush_row_batches, new_row_batches
+from raw_archive import ARCHIVE_DIR, list_shards, load_payload, read_index, shard_name
+from response_cache import bump_generation
+from snapshot_store import SERIES_TABLES, encode_values, load_member_state, load_series_state, mark_absent, rebuild_series_state, update_state, write_series_rows
+
+# Re-parses the raw archive (raw_archive.py) into a database, e.g. to backfill
+# a new table or rebuild a database from scratch:
+#
+#   python replay_archive.py --db rebuilt.db
+#   python replay_archive.py --tables bestiary_snapshots --since 1700000000
+#
+# Each archive shard (one month) is parsed by its own worker process. The
+# parent writes the shards in order, one transaction per shard, so replaying
+# stays correct for the change-only tables.
+#
+# A plain replay appends: its progress is the newest snapshot already in the
+# target database, so an interrupted run picks up after it. With --tables,
+# --since or --until it backfills older snapshots into existing databases
+# instead (INSERT OR IGNORE keeps the rows already there), records progress
+# per table and shard in replay_progress, and rebuilds series_state and the
+# rollups once the rows are in.
+
+# --- Workers ---
+
+def parse_shard(shard, archive_dir, after, until, full_copy):
+    """Parses one shard's snapshots in (after, until] into row batches.
+
+    Returns (shard, entries read, [(snapshot_timestamp, batches)]). Series rows
+    that repeat the previous snapshot of the same shard are dropped here already,
+    so only changes travel back to the parent, and series missing from a later
+    snapshot of the shard get their absence rows here too.
+    """
+    entries = [entry for entry in read_index(shard, archive_dir) if after < entry[0] <= until]
+    snapshots, previous, seen_transactions, parsed = [], {}, set(), {}
+    for snapshot_timestamp, group in groupby(entries, key=lambda entry: entry[0]):
+        batches = new_row_batches()
+        for _, profile_id, digest, member_uuids in group:
+            # Identical payloads are stored once; load each one once per shard too.
+            if digest not in parsed:
+                try:
+                    parsed[digest] = load_payload(digest, archive_dir)
+                except (OSError, ValueError) as e:
+                    print(f"Warning: archived payload {digest} for profile {profile_id} is unreadable ({e}), skipping it.")
+                    parsed[digest] = None
+            build_row_batches(parsed[digest], snapshot_timestamp, member_uuids or None, batches)
+
+        transactions = [row for row in batches['bank_transactions'] if row not in seen_transactions]
+        seen_transactions.update(transactions)
+        batches['bank_transactions'] = transactions
+        if not full_copy:
+            members = [row[:3] for row in batches['profile_snapshots']]
+            for table in SERIES_TABLES:
+                changed = []
+                for row in mark_absent(previous, table, batches[table], members):
+                    key = (table, row[0], row[1], row[3])
+                    encoded = encode_values(row[4:])
+                    if previous.get(key) != encoded:
+                        update_state(previous, key, encoded)
+                        changed.append(row)
+                batches[table] = changed
+        snapshots.append((snapshot_timestamp, batches))
+    return shard, len(entries), snapshots
+
+# --- Progress ---
+
+def _connect_progress(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS replay_progress (
+            table_name TEXT NOT NULL, shard TEXT NOT NULL, replayed_through INTEGER NOT NULL,
+            PRIMARY KEY (table_name, shard)
+        ) WITHOUT ROWID
+    ''')
+
+def load_progress(cursor, tables):
+    """{(table, shard): newest snapshot timestamp already backfilled} for `tables`."""
+    rows = cursor.execute('SELECT table_name, shard, replayed_through FROM replay_progress').fetchall()
+    return {(row[0], row[1]): row[2] for row in rows if row[0] in tables}
+
+def clear_progress(cursor, tables):
+    cursor.executemany('DELETE FROM replay_progress WHERE table_name = ?', [(table,) for table in tables])
+
+# --- Replay ---
+
+def mark_absent_after(cursor, archive_dir, until, tables):
+    """Marks backfilled series absent from the stored snapshot right after `until`,
+    which was written without knowing them. Returns absence rows written."""
+    following = None
+    for shard in list_shards(archive_dir):
+        if shard >= shard_name(until):
+            following = next((entry[0] for entry in read_index(shard, archive_dir) if entry[0] > until), None)
+            if following is not None:
+                break
+    if following is None:
+        return 0
+    _, _, snapshots = parse_shard(shard_name(following), archive_dir, until, following, True)
+    batches = snapshots[0][1]
+    stored = {row[:3] for row in cursor.execute('SELECT profile_id, member_uuid, snapshot_timestamp FROM profile_snapshots WHERE snapshot_timestamp = ?', (following,))}
+    members = [row[:3] for row in batches['profile_snapshots'] if row[:3] in stored]
+    written = 0
+    for table in tables:
+        if table not in SERIES_TABLES:
+            continue
+        state = {}
+        for member in members:
+            state.update(load_member_state(cursor, table, member, following))
+        markers = [row for row in mark_absent(state, table, batches[table], members) if all(value is None for value in row[4:])]
+        written += write_series_rows(cursor, {}, table, markers, record_state=False)
+    return written
+
+def replay(database_file=DATABASE_FILE, archive_dir=ARCHIVE_DIR, workers=None, since=None, until=None, tables=None, restart=False):
+    """Replays archived snapshots into a database. Returns snapshots written.
+
+    Without `since`, `until` or `tables` this appends every snapshot newer than
+    the database's latest one. Otherwise it backfills the snapshots in
+    [since, until] into `tables` (default: all), including older ones, and
+    resumes per table and shard from replay_progress; `restart` forgets that
+    progress first.
+    """
+    all_tables = list(new_row_batches())
+    backfill = since is not None or until is not None or tables is not None
+    tables = list(tables) if tables is not None else all_tables
+    unknown = set(tables) - set(all_tables)
+    if unknown:
+        raise ValueError(f"Unknown table(s): {', '.join(sorted(unknown))}. Choose from {', '.join(all_tables)}.")
+    until = until if until is not None else 2 ** 62
+    conn = connect_database(database_file)
+    try:
+        cursor = conn.cursor()
+        create_database_schema(cursor)
+        _connect_progress(cursor)
+        progress = {}
+        if backfill:
+            if restart:
+                clear_progress(cursor, tables)
+                conn.commit()
+            progress = load_progress(cursor, tables)
+            after = (since or 0) - 1
+            # Older snapshots must not overwrite the latest values; both are rebuilt at the end.
+            state, record_state = None, False
+        else:
+            latest = cursor.execute('SELECT MAX(snapshot_timestamp) FROM profile_snapshots').fetchone()[0]
+            after = latest or -1
+            if latest:
+                print(f"Database already holds snapshots up to {latest}; replaying newer ones only.")
+            state, record_state = load_series_state(cursor), True
+        last_shard = shard_name(until) if until < 2 ** 62 else None
+        shards = [shard for shard in list_shards(archive_dir) if shard >= shard_name(max(after, 0)) and (last_shard is None or shard <= last_shard)]
+        if not shards:
+            print("Nothing to replay.")
+            return 0
+
+        def shard_after(shard):
+            # Every selected table is replayed past its own progress in this shard.
+            return max([after] + [min(progress.get((table, shard), -1) for table in tables)])
+
+        full_copy = SNAPSHOT_STORAGE == 'full'
+        workers = max(1, min(workers or os.cpu_count() or 1, len(shards)))
+        replayed = 0
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = deque()
+            remaining = iter(shards)
+            while True:
+                # Keep a few shards parsed ahead without holding the whole archive in memory.
+                while len(pending) < workers * 2:
+                    shard = next(remaining, None)
+                    if shard is None:
+                        break
+                    pending.append(pool.submit(parse_shard, shard, archive_dir, shard_after(shard), until, full_copy))
+                if not pending:
+                    break
+                shard, entries, snapshots = pending.popleft().result()
+                written = 0
+                # A backfill starts each shard from the rows stored before it, since it may skip earlier ones.
+                shard_state = {} if backfill else state
+                cursor.execute('BEGIN IMMEDIATE')
+                try:
+                    for index, (snapshot_timestamp, batches) in enumerate(snapshots):
+                        # Only the first snapshot of a shard still lists every series
+                        # (parse_shard() marked the absent ones in the others).
+                        members = [row[:3] for row in batches['profile_snapshots']] if full_copy or index == 0 else ()
+                        for table in all_tables:
+                            if table not in tables or progress.get((table, shard), -1) >= snapshot_timestamp:
+                                batches[table] = []
+                            elif backfill and index == 0 and table in SERIES_TABLES:
+                                # Compare the shard's first snapshot with what is stored before it.
+                                for member in {snapshot[:2] for snapshot in members}:
+                                    shard_state.update(load_member_state(cursor, table, member, snapshot_timestamp))
+                        written += sum(flush_row_batches(cursor, batches, shard_state, record_state, members).values())
+                        if not backfill:
+                            update_rollups(cursor, snapshot_timestamp)
+                    if backfill and snapshots:
+                        cursor.executemany('INSERT OR REPLACE INTO replay_progress (table_name, shard, replayed_through) VALUES (?, ?, MAX(?, ?))',
+                                           [(table, shard, snapshots[-1][0], progress.get((table, shard), -1)) for table in tables])
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                replayed += len(snapshots)
+                print(f"Shard {shard}: {entries} archived response(s), {len(snapshots)} snapshot(s), {written} rows written.")
+        if backfill:
+            # Also finishes what an interrupted backfill left behind.
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                if until < 2 ** 62:
+                    mark_absent_after(cursor, archive_dir, until, tables)
+                rebuild_series_state(cursor, [table for table in tables if table in SERIES_TABLES])
+                rebuild_rollups(cursor)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            print("Rebuilt series state and rollups.")
+        if replayed:
+            bump_generation(database_file)
+        print(f"Replayed {replayed} snapshot(s) into '{database_file}'.")
+        return replayed
+    finally:
+        conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild or backfill the stats database from the raw response archive.")
+    parser.add_argument('--db', default=DATABASE_FILE, help="target database (created if missing)")
+    parser.add_argument('--archive', default=ARCHIVE_DIR, help="archive directory")
+    parser.add_argument('--workers', type=int, default=None, help="parser processes (default: one per CPU)")
+    parser.add_argument('--since', type=int, default=None, help="first snapshot timestamp to backfill")
+    parser.add_argument('--until', type=int, default=None, help="last snapshot timestamp to backfill")
+    parser.add_argument('--tables', default=None, help="comma-separated tables to backfill (default: all)")
+    parser.add_argument('--restart', action='store_true', help="forget the backfill progress of these tables first")
+    args = parser.parse_args()
+    tables = [table for table in args.tables.split(',') if table] if args.tables else None
+    try:
+        replay(args.db, args.archive, args.workers, args.since, args.until, tables, args.restart)
+    except ValueError as e:
+        parser.error(str(e))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+# response_cache.py
+
+import functools
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from flask import Response, current_app, request
+
+# Responses of the read-only API only change when the collector commits a
+# snapshot. The collector records every commit by rewriting a small marker
+# file next to the database (the "generation"); cache keys and ETags embed the
+# generation, so committing a snapshot invalidates everything at once and a
+# browser revalidation can be answered with a stat() instead of a query.
+
+CACHE_FILE = os.getenv("RESPONSE_CACHE_FILE", "response_cache.db")
+MEMORY_LIMIT_BYTES = int(os.getenv("RESPONSE_CACHE_MEMORY_BYTES", 32 * 1024 * 1024))
+SHARED_LIMIT_ROWS = int(os.getenv("RESPONSE_CACHE_SHARED_ROWS", 2048))
+
+# --- Snapshot generation ---
+
+def marker_path(database_file):
+    return f"{database_file}.generation"
+
+def current_generation(database_file):
+    """Identifies the last committed snapshot without opening the database."""
+    try:
+        stat = os.stat(marker_path(database_file))
+        return f"{stat.st_mtime_ns:x}{stat.st_size:x}"
+    except FileNotFoundError:
+        pass
+    # No marker yet: fall back to the database files themselves.
+    parts = []
+    for suffix in ('', '-wal'):
+        try:
+            parts.append(f"{os.stat(database_file + suffix).st_mtime_ns:x}")
+        except FileNotFoundError:
+            parts.append('0')
+    return '-'.join(parts)
+
+def bump_generation(database_file, snapshot_timestamp=None):
+    """Called by the collector after each commit; invalidates every cached response."""
+    path = marker_path(database_file)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(f"{snapshot_timestamp or int(time.time())} {time.time_ns()}\n")
+    os.replace(tmp_path, path)
+    try:
+        conn = sqlite3.connect(CACHE_FILE, timeout=1)
+        with conn:
+            conn.execute('DELETE FROM responses')
+        conn.close()
+    except sqlite3.Error:
+        pass # No shared tier yet, or it is busy; stale rows are unreachable anyway.
+
+# --- Cache tiers ---
+
+class ResponseCache:
+    """Two-tier cache: a per-worker LRU bounded by bytes, backed by a SQLite
+    file shared between gunicorn workers."""
+
+    def __init__(self, path=CACHE_FILE, memory_limit=MEMORY_LIMIT_BYTES, shared_limit=SHARED_LIMIT_ROWS):
+        self.path = path
+        self.memory_limit = memory_limit
+        self.shared_limit = shared_limit
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._generation = None
+
+    def _shared(self):
+        # Connections must not cross a fork, so reopen in every worker process.
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=0.5, check_same_thread=False, isolation_level=None)
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = OFF')
+            conn.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, generation TEXT NOT NULL, body BLOB NOT NULL, stored_at REAL NOT NULL)')
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def _forget_older_generations(self, generation):
+        if generation == self._generation:
+            return
+        self._generation = generation
+        self._entries.clear()
+        self._size = 0
+        try:
+            self._shared().execute('DELETE FROM responses WHERE generation != ?', (generation,))
+        except sqlite3.Error:
+            pass
+
+    def get(self, key, generation):
+        with self._lock:
+            self._forget_older_generations(generation)
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+                return body
+            try:
+                row = self._shared().execute('SELECT body FROM responses WHERE key = ? AND generation = ?', (key, generation)).fetchone()
+            except sqlite3.Error:
+                row = None
+            if row is None:
+                return None
+            body = zlib.decompress(row[0])
+            self._remember(key, body)
+            return body
+
+    def put(self, key, generation, body):
+        with self._lock:
+            self._forget_older_generations(generation)
+            self._remember(key, body)
+            try:
+                conn = self._shared()
+                conn.execute('INSERT OR REPLACE INTO responses (key, generation, body, stored_at) VALUES (?, ?, ?, ?)',
+                             (key, generation, zlib.compress(body, 1), time.time()))
+                conn.execute('DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY stored_at DESC LIMIT -1 OFFSET ?)', (self.shared_limit,))
+            except sqlite3.Error:
+                pass
+
+    def _remember(self, key, body):
+        if len(body) > self.memory_limit:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._size -= len(previous)
+        self._entries[key] = body
+        self._size += len(body)
+        while self._size > self.memory_limit:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+
+# --- Flask integration ---
+
+def cached_response(cache, database_file):
+    """Caches a JSON view per (path, query string, snapshot generation) and
+    answers If-None-Match revalidations with 304 before touching the database."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            generation = current_generation(database_file() if callable(database_file) else database_file)
+            key = f"{request.path}?{'&'.join(sorted(f'{k}={v}' for k, v in request.args.items(multi=True)))}"
+            etag = f"{generation}-{zlib.crc32(key.encode()):08x}"
+            if etag in request.if_none_match:
+                response = Response(status=304)
+            else:
+                body = cache.get(key, generation)
+                if body is None:
+                    response = current_app.make_response(view(*args, **kwargs))
+                    if response.status_code != 200 or response.is_streamed or response.mimetype != 'application/json':
+                        return response
+                    cache.put(key, generation, response.get_data())
+                else:
+                    response = Response(body, mimetype='application/json')
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return wrapper
+    return decorator
@@ -6,6 +6,9 @@ import { format } from 'date-fns';
 
 const API_BASE_URL = 'http://127.0.0.1:5000';
 
+// Everything the first render needs, fetched in one request by <App>.
+const DASHBOARD_SECTIONS = ['latest', 'diff:collections', 'diff:bestiary', 'history:skills', 'history:collections', 'history:bestiary', 'history:profile_stats'];
+
 const NAME_MAP = {
     'total_money': 'Total Money', // For the history chart legend
     'kills': 'Total Kills',
@@ -77,26 +80,7 @@ const LoadingSpinner = () => (
 
 // --- Data-driven Components ---
 
-function LatestStats() {
-    const [stats, setStats] = useState(null);
-
-    useEffect(() => {
-        const fetchLatestStats = async () => {
-            try {
-                const tsRes = await fetch(`${API_BASE_URL}/api/latest_snapshot_timestamp`);
-                const tsData = await tsRes.json();
-                if (tsData.latest_timestamp) {
-                    const statsRes = await fetch(`${API_BASE_URL}/api/profile_stats/${tsData.latest_timestamp}`);
-                    const statsData = await statsRes.json();
-                    setStats(statsData);
-                }
-            } catch (error) {
-                console.error("Failed to fetch latest stats:", error);
-            }
-        };
-        fetchLatestStats();
-    }, []);
-
+function LatestStats({ stats }) {
     const totalMoney = useMemo(() => {
         if (!stats) return '...';
         const combined = (stats.purse || 0) + (stats.bank_balance || 0);
@@ -114,12 +98,20 @@ function LatestStats() {
     );
 }
 
-function ProgressTable({ title, apiEndpoint }) {
+// `initialData` is the dashboard's copy for the default range; other ranges are fetched on demand.
+function ProgressTable({ title, apiEndpoint, initialData }) {
     const [data, setData] = useState([]);
     const [loading, setLoading] = useState(true);
     const [timeRange, setTimeRange] = useState('today');
 
     const fetchData = useCallback(async () => {
+        if (timeRange === 'today' && initialData !== undefined) {
+            if (initialData !== null) {
+                setData(initialData);
+                setLoading(false);
+            }
+            return;
+        }
         setLoading(true);
         try {
             const res = await fetch(`${API_BASE_URL}/api/diff/${apiEndpoint}?range=${timeRange}`);
@@ -130,7 +122,7 @@ function ProgressTable({ title, apiEndpoint }) {
         } finally {
             setLoading(false);
         }
-    }, [apiEndpoint, timeRange, title]);
+    }, [apiEndpoint, timeRange, title, initialData]);
 
     useEffect(() => {
         fetchData();
@@ -171,7 +163,7 @@ function ProgressTable({ title, apiEndpoint }) {
     );
 }
 
-function HistoricalChart({ title, apiEndpoint }) {
+function HistoricalChart({ title, apiEndpoint, initialData }) {
     const [loading, setLoading] = useState(true);
     const [timeRange, setTimeRange] = useState('7d');
     const [allItems, setAllItems] = useState([]);
@@ -181,10 +173,17 @@ function HistoricalChart({ title, apiEndpoint }) {
     const formatName = (name) => (NAME_MAP[name] || name).replace(/_/g, ' ').replace(/:/g, ' ').replace(/\b\w/g, l => l.toUpperCase());
 
     const fetchData = useCallback(async () => {
+        let historyData = null;
+        if (timeRange === '7d' && initialData !== undefined) {
+            if (initialData === null) return;
+            historyData = initialData;
+        }
         setLoading(true);
         try {
-            const res = await fetch(`${API_BASE_URL}/api/history/${apiEndpoint}?range=${timeRange}`);
-            const historyData = await res.json();
+            if (historyData === null) {
+                const res = await fetch(`${API_BASE_URL}/api/history/${apiEndpoint}?range=${timeRange}`);
+                historyData = await res.json();
+            }
             
             const itemKeys = Object.keys(historyData);
             setAllItems(itemKeys);
@@ -212,7 +211,7 @@ function HistoricalChart({ title, apiEndpoint }) {
         } finally {
             setLoading(false);
         }
-    }, [apiEndpoint, timeRange, title, selectedItems.length]);
+    }, [apiEndpoint, timeRange, title, selectedItems.length, initialData]);
 
     useEffect(() => {
         fetchData();
@@ -270,31 +269,58 @@ function HistoricalChart({ title, apiEndpoint }) {
 export default function App() {
     const [snapshotInfo, setSnapshotInfo] = useState('Loading...');
     const [isCollecting, setIsCollecting] = useState(false);
+    // null while loading; panels wait for it instead of fetching on their own.
+    const [dashboard, setDashboard] = useState(null);
+
+    // Polls the queued collection job until it finishes, then reloads the data.
+    const waitForJob = async (jobId) => {
+        try {
+            const res = await fetch(`${API_BASE_URL}/api/collect_status/${jobId}`);
+            const job = await res.json();
+            if (job.state === 'succeeded') {
+                setSnapshotInfo('Collection finished! Refreshing...');
+                window.location.reload();
+                return;
+            }
+            if (job.state === 'failed') {
+                setSnapshotInfo(`Collection failed: ${job.message || 'unknown error'}`);
+                setIsCollecting(false);
+                return;
+            }
+            setSnapshotInfo(job.state === 'running' ? 'Collecting data...' : 'Collection queued...');
+            setTimeout(() => waitForJob(jobId), 2000);
+        } catch (error) {
+            console.error("Failed to fetch collection status:", error);
+            setSnapshotInfo('Error checking collection status.');
+            setIsCollecting(false);
+        }
+    };
 
     const handleCollectData = async () => {
         setIsCollecting(true);
         setSnapshotInfo('Triggering data collection...');
         try {
             const res = await fetch(`${API_BASE_URL}/api/trigger_collect`, { method: 'POST' });
+            const data = await res.json();
             if (res.ok) {
-                setSnapshotInfo('Collection process started! Refreshing in 5s...');
-                setTimeout(() => window.location.reload(), 5000); 
-            } else {
-                setSnapshotInfo('Failed to start collection.');
+                setSnapshotInfo(data.message);
+                waitForJob(data.job_id);
+                return;
             }
+            setSnapshotInfo(data.message || data.error || 'Failed to start collection.');
         } catch (error) {
             console.error("Failed to trigger collection:", error);
             setSnapshotInfo('Error starting collection.');
-        } finally {
-            setTimeout(() => setIsCollecting(false), 5000);
         }
+        setTimeout(() => setIsCollecting(false), 5000);
     };
     
     useEffect(() => {
-        const fetchTimestamp = async () => {
+        const fetchDashboard = async () => {
             try {
-                const res = await fetch(`${API_BASE_URL}/api/latest_snapshot_timestamp`);
+                const res = await fetch(`${API_BASE_URL}/api/dashboard?sections=${DASHBOARD_SECTIONS.join(',')}`);
                 const data = await res.json();
+                setDashboard(data.sections);
                 if (data.latest_timestamp) {
                     const date = new Date(data.latest_timestamp * 1000);
                     setSnapshotInfo(`Latest data: ${date.toLocaleString()}`);
@@ -303,11 +329,15 @@ export default function App() {
                 }
             } catch (error) {
                 setSnapshotInfo('Error: Could not connect to backend.');
+                setDashboard({});
             }
         };
-        fetchTimestamp();
+        fetchDashboard();
     }, []);
 
+    // undefined (not null) once loaded lets a panel fall back to fetching its own data.
+    const section = (name) => (dashboard === null ? null : dashboard[name]);
+
     return (
         <div className="bg-gray-900 text-gray-100 min-h-screen p-4 sm:p-8 font-sans bg-gradient-to-br from-gray-900 to-indigo-900/30">
             <header className="max-w-7xl mx-auto flex flex-col sm:flex-row justify-between items-center mb-8">
@@ -326,26 +356,26 @@ export default function App() {
 
             <main className="max-w-7xl mx-auto grid grid-cols-1 lg:grid-cols-2 gap-6">
                 <div className="lg:col-span-2">
-                    <LatestStats />
+                    <LatestStats stats={section('latest')?.profile_stats || null} />
                 </div>
 
-                <ProgressTable title="Collection Progress" apiEndpoint="collections" />
-                <ProgressTable title="Bestiary Progress" apiEndpoint="bestiary" />
+                <ProgressTable title="Collection Progress" apiEndpoint="collections" initialData={section('diff:collections')} />
+                <ProgressTable title="Bestiary Progress" apiEndpoint="bestiary" initialData={section('diff:bestiary')} />
                 
                 <div className="lg:col-span-2">
-                    <HistoricalChart title="Skill XP Progression" apiEndpoint="skills" />
+                    <HistoricalChart title="Skill XP Progression" apiEndpoint="skills" initialData={section('history:skills')} />
                 </div>
 
                 <div className="lg:col-span-2">
-                    <HistoricalChart title="Collection History" apiEndpoint="collections" />
+                    <HistoricalChart title="Collection History" apiEndpoint="collections" initialData={section('history:collections')} />
                 </div>
 
                 <div className="lg:col-span-2">
-                    <HistoricalChart title="Bestiary History" apiEndpoint="bestiary" />
+                    <HistoricalChart title="Bestiary History" apiEndpoint="bestiary" initialData={section('history:bestiary')} />
                 </div>
                 
                  <div className="lg:col-span-2">
-                    <HistoricalChart title="Profile Stats History" apiEndpoint="profile_stats" />
+                    <HistoricalChart title="Profile Stats History" apiEndpoint="profile_stats" initialData={section('history:profile_stats')} />
                 </div>
             </main>
         </div>
@@ -0,0 +1,300 @@
+# snapshot_store.py
+
+import json
+import re
+from itertools import groupby
+from operator import itemgetter
+
+# Change-only ("delta") storage for the per-series snapshot tables.
+#
+# profile_snapshots still gets one row per collector run and doubles as the
+# list of snapshot timestamps. The skill, slayer, collection and bestiary
+# tables only get a row when a series' value differs from the last value we
+# stored for that member, which is kept in `series_state` for O(1) checks.
+# The readers below forward-fill those rows over the snapshot list, so they
+# return exactly what a full copy per snapshot would have returned.
+#
+# A series the member had before but that a snapshot leaves out (e.g. the
+# Collections API was switched off) gets an absence row with every value
+# column NULL, so forward-filling stops there until the series comes back.
+
+# table -> (series name column, value columns)
+SERIES_TABLES = {
+    'skill_snapshots': ('skill_name', ('total_xp', 'level')),
+    'slayer_snapshots': ('slayer_name', ('total_xp', 'tier1_kills', 'tier2_kills', 'tier3_kills', 'tier4_kills', 'tier5_kills')),
+    'collection_snapshots': ('collection_name', ('amount', 'tier')),
+    'bestiary_snapshots': ('mob_id', ('kills',)),
+}
+
+# --- Writing ---
+
+# repr() of a list of plain ints/floats is already the JSON encoding.
+_NUMERIC_LIST = re.compile(r'\[[-+0-9.e, ]*\]')
+
+def encode_values(values):
+    """The comparison key stored in series_state for one row's value columns (a JSON array)."""
+    text = repr(list(values))
+    return text if _NUMERIC_LIST.fullmatch(text) else json.dumps(list(values))
+
+def absent_condition(table, alias=None):
+    """SQL condition that holds for the absence rows of `table` (every value column NULL)."""
+    prefix = f'{alias}.' if alias else ''
+    return '(' + ' AND '.join(f'{prefix}{col} IS NULL' for col in SERIES_TABLES[table][1]) + ')'
+
+def update_state(state, key, encoded):
+    """Records the encoded values of series `key` (table, profile_id, member_uuid, name) in `state`.
+
+    The state also maps (table, profile_id, member_uuid) to the member's series
+    names, so mark_absent() never scans every series.
+    """
+    if key not in state:
+        state.setdefault(key[:3], set()).add(key[3])
+    state[key] = encoded
+
+def load_series_state(cursor):
+    """Returns the state (see update_state()) of the last stored row per series."""
+    state = {}
+    for row in cursor.execute('SELECT kind, profile_id, member_uuid, name, value FROM series_state'):
+        update_state(state, tuple(row[:4]), row[4])
+    return state
+
+def load_member_state(cursor, table, member, timestamp):
+    """Like load_series_state(), for one member's newest row per series in `table` before `timestamp`."""
+    name_col, value_cols = SERIES_TABLES[table]
+    rows = cursor.execute(f'''
+        SELECT {name_col}, MAX(snapshot_timestamp), {", ".join(value_cols)} FROM {table}
+        WHERE profile_id = ? AND member_uuid = ? AND snapshot_timestamp < ?
+        GROUP BY {name_col}
+    ''', (member[0], member[1], timestamp)).fetchall()
+    state = {}
+    for row in rows:
+        update_state(state, (table, member[0], member[1], row[0]), encode_values(row[2:]))
+    return state
+
+def mark_absent(state, table, rows, snapshots):
+    """Adds an absence row for every series a member had a value for, in `state`
+    or an earlier snapshot of `rows`, that one of `snapshots` leaves out.
+
+    `rows` are (profile_id, member_uuid, snapshot_timestamp, name, *values) rows
+    and `snapshots` the (profile_id, member_uuid, snapshot_timestamp) keys whose
+    series they list completely. Returns the rows with the absence rows merged
+    in, in key order.
+    """
+    if not snapshots:
+        return rows
+    absent_values = (None,) * len(SERIES_TABLES[table][1])
+    absent = encode_values(absent_values)
+    present = {}
+    for snapshot, group in groupby(rows, key=itemgetter(0, 1, 2)):
+        present.setdefault(snapshot, set()).update(row[3] for row in group)
+    previous, markers = {}, []
+    for snapshot in sorted(set(snapshots)):
+        member = (table,) + snapshot[:2]
+        names = present.get(snapshot, set())
+        if member in previous:
+            missing = previous[member] - names
+        else:
+            missing = [name for name in state.get(member, set()) - names if state[member + (name,)] != absent]
+        markers.extend(snapshot + (name,) + absent_values for name in sorted(missing))
+        previous[member] = names
+    return sorted(rows + markers, key=lambda row: row[:4]) if markers else rows
+
+def write_series_rows(cursor, state, table, rows, full_copy=False, record_state=True):
+    """Stores a batch of (profile_id, member_uuid, snapshot_timestamp, name, *values) rows,
+    skipping rows whose values are unchanged unless `full_copy` is set. Absence
+    rows (see mark_absent()) are stored like values, but never repeated.
+
+    `state` is updated either way; series_state only when `record_state` is set
+    (a backfill of older snapshots must not overwrite the latest values).
+    Returns the number of snapshot rows written.
+    """
+    inserts, state_rows = [], []
+    absent = encode_values((None,) * len(SERIES_TABLES[table][1]))
+    for row in rows:
+        key = (table, row[0], row[1], row[3])
+        encoded = encode_values(row[4:])
+        if state.get(key) != encoded:
+            update_state(state, key, encoded)
+            state_rows.append(key + (row[2], encoded))
+            inserts.append(row)
+        elif full_copy and encoded != absent:
+            inserts.append(row)
+    if inserts:
+        name_col, value_cols = SERIES_TABLES[table]
+        placeholders = ', '.join('?' * (4 + len(value_cols)))
+        cursor.executemany(f'INSERT OR IGNORE INTO {table} (profile_id, member_uuid, snapshot_timestamp, {name_col}, {", ".join(value_cols)}) VALUES ({placeholders})', inserts)
+    if state_rows and record_state:
+        cursor.executemany('INSERT OR REPLACE INTO series_state (kind, profile_id, member_uuid, name, snapshot_timestamp, value) VALUES (?, ?, ?, ?, ?, ?)', state_rows)
+    return len(inserts)
+
+# --- Maintenance ---
+
+# Every member snapshot with the one before and after it.
+_SNAPSHOT_NEIGHBOURS = '''
+    SELECT profile_id, member_uuid, snapshot_timestamp,
+           LAG(snapshot_timestamp) OVER member AS previous_timestamp, LEAD(snapshot_timestamp) OVER member AS next_timestamp
+    FROM profile_snapshots
+    WINDOW member AS (PARTITION BY profile_id, member_uuid ORDER BY snapshot_timestamp)
+'''
+
+def compact_series_table(cursor, table):
+    """Turns full copies into change rows: adds an absence row where a series is
+    missing from the member's next snapshot, then deletes every row whose values
+    equal the same series' row in the member's previous snapshot.
+
+    Returns (absence rows added, rows removed).
+    """
+    name_col, value_cols = SERIES_TABLES[table]
+    # rowcount stays -1 for statements starting with WITH before Python 3.12.
+    changes = cursor.connection.total_changes
+    cursor.execute(f'''
+        WITH snapshots AS ({_SNAPSHOT_NEIGHBOURS})
+        INSERT INTO {table} (profile_id, member_uuid, snapshot_timestamp, {name_col})
+        SELECT t.profile_id, t.member_uuid, s.next_timestamp, t.{name_col}
+        FROM {table} t JOIN snapshots s USING (profile_id, member_uuid, snapshot_timestamp)
+        WHERE s.next_timestamp IS NOT NULL AND NOT {absent_condition(table, 't')} AND NOT EXISTS (
+            SELECT 1 FROM {table} n
+            WHERE n.profile_id = t.profile_id AND n.member_uuid = t.member_uuid AND n.snapshot_timestamp = s.next_timestamp AND n.{name_col} = t.{name_col})
+    ''')
+    added, changes = cursor.connection.total_changes - changes, cursor.connection.total_changes
+    unchanged = ' AND '.join(f't.{col} IS p.{col}' for col in value_cols)
+    cursor.execute(f'''
+        WITH snapshots AS ({_SNAPSHOT_NEIGHBOURS})
+        DELETE FROM {table} WHERE (profile_id, member_uuid, snapshot_timestamp, {name_col}) IN (
+            SELECT t.profile_id, t.member_uuid, t.snapshot_timestamp, t.{name_col}
+            FROM {table} t JOIN snapshots s USING (profile_id, member_uuid, snapshot_timestamp)
+            JOIN {table} p ON p.profile_id = t.profile_id AND p.member_uuid = t.member_uuid AND p.snapshot_timestamp = s.previous_timestamp AND p.{name_col} = t.{name_col}
+            WHERE {unchanged}
+        )
+    ''')
+    return added, cursor.connection.total_changes - changes
+
+def rebuild_series_state(cursor, tables=SERIES_TABLES):
+    """Re-seeds series_state from the newest stored row of every series in `tables`."""
+    for table in tables:
+        name_col, value_cols = SERIES_TABLES[table]
+        cursor.execute('DELETE FROM series_state WHERE kind = ?', (table,))
+        rows = cursor.execute(f'''
+            SELECT profile_id, member_uuid, {name_col}, MAX(snapshot_timestamp), {", ".join(value_cols)}
+            FROM {table} GROUP BY profile_id, member_uuid, {name_col}
+        ''').fetchall()
+        cursor.executemany('INSERT INTO series_state (kind, profile_id, member_uuid, name, snapshot_timestamp, value) VALUES (?, ?, ?, ?, ?, ?)',
+                           [(table, row[0], row[1], row[2], row[3], encode_values(row[4:])) for row in rows])
+
+# --- Reading ---
+
+def resolve_member(conn, member_uuid=None):
+    """Returns (profile_id, member_uuid) of the requested member, or of whoever
+    was snapshotted last when none is given. None if nothing matches."""
+    if member_uuid:
+        row = conn.execute('SELECT profile_id, member_uuid FROM profile_snapshots WHERE member_uuid = ? ORDER BY snapshot_timestamp DESC LIMIT 1', (member_uuid,)).fetchone()
+    else:
+        row = conn.execute('SELECT profile_id, member_uuid FROM profile_snapshots ORDER BY snapshot_timestamp DESC LIMIT 1').fetchone()
+    return (row[0], row[1]) if row else None
+
+def snapshot_timestamps(conn, member, start_timestamp=0, end_timestamp=None):
+    """Lists the member's snapshot timestamps in [start, end], oldest first."""
+    if end_timestamp is None:
+        end_timestamp = 2 ** 62
+    rows = conn.execute('SELECT snapshot_timestamp FROM profile_snapshots WHERE profile_id = ? AND member_uuid = ? AND snapshot_timestamp BETWEEN ? AND ? ORDER BY snapshot_timestamp ASC',
+                        (member[0], member[1], start_timestamp, end_timestamp)).fetchall()
+    return [row[0] for row in rows]
+
+def values_at(conn, table, member, timestamp, columns=None):
+    """Returns {name: (value columns...)} as of `timestamp` for one member.
+
+    Each series is a single index seek on (profile_id, member_uuid, name, snapshot_timestamp).
+    Series absent from the member's snapshot at that time are left out.
+    """
+    name_col, value_cols = SERIES_TABLES[table]
+    columns = columns or value_cols
+    rows = conn.execute(f'''
+        SELECT s.name, {", ".join(f"t.{col}" for col in columns)}
+        FROM series_state s JOIN {table} t
+          ON t.profile_id = s.profile_id AND t.member_uuid = s.member_uuid AND t.{name_col} = s.name
+         AND t.snapshot_timestamp = (
+            SELECT MAX(snapshot_timestamp) FROM {table}
+            WHERE profile_id = s.profile_id AND member_uuid = s.member_uuid AND {name_col} = s.name AND snapshot_timestamp <= ?)
+        WHERE s.kind = ? AND s.profile_id = ? AND s.member_uuid = ? AND NOT {absent_condition(table, 't')}
+        ORDER BY s.name
+    ''', (timestamp, table, member[0], member[1])).fetchall()
+    return {row[0]: tuple(row[1:]) for row in rows}
+
+def forward_fill(points, current, changes, keep_absent=False):
+    """Replays change rows over a timeline.
+
+    `points` yields (key, timestamp) pairs in key order, `current` maps each
+    series to its value before the first key and `changes` yields
+    (name, value, key, absent) rows in key order. Yields (name, value, timestamp)
+    for every series at every point. A series is left out from an absent row
+    until its next change, or yielded with a None value if `keep_absent` is set.
+    """
+    pending = next(changes, None)
+    for key, timestamp in points:
+        while pending is not None and pending[2] <= key:
+            if pending[3] and not keep_absent:
+                current.pop(pending[0], None)
+            else:
+                current[pending[0]] = pending[1]
+            pending = next(changes, None)
+        for name, value in current.items():
+            yield name, value, timestamp
+
+def iter_series_history(conn, table, member, start_timestamp=0, end_timestamp=None, value_col=None, keep_absent=False):
+    """Yields (name, value, snapshot_timestamp) for every snapshot in range, oldest first,
+    exactly as if each snapshot had stored a full copy of the series.
+
+    `keep_absent` also yields a series absent from a snapshot, with a None value.
+    """
+    name_col, value_cols = SERIES_TABLES[table]
+    value_col = value_col or value_cols[0]
+    snapshots = snapshot_timestamps(conn, member, start_timestamp, end_timestamp)
+    if not snapshots:
+        return
+    current = {name: values[0] for name, values in values_at(conn, table, member, start_timestamp - 1, (value_col,)).items()}
+    changes = conn.execute(f'''
+        SELECT {name_col}, {value_col}, snapshot_timestamp, {absent_condition(table)} FROM {table}
+        WHERE profile_id = ? AND member_uuid = ? AND snapshot_timestamp BETWEEN ? AND ?
+        ORDER BY snapshot_timestamp ASC
+    ''', (member[0], member[1], snapshots[0], snapshots[-1]))
+    yield from forward_fill(((ts, ts) for ts in snapshots), current, iter(changes), keep_absent)
+
+def series_names(conn, table, member):
+    """Lists the names of every series the member has ever stored in `table`."""
+    rows = conn.execute('SELECT name FROM series_state WHERE kind = ? AND profile_id = ? AND member_uuid = ? ORDER BY name',
+                        (table, member[0], member[1]))
+    return [row[0] for row in rows]
+
+def iter_series_points(conn, table, member, name, start_timestamp=0, end_timestamp=None, value_col=None):
+    """Yields (snapshot_timestamp, value) of a single series, oldest first,
+    skipping the snapshots it is absent from.
+
+    Walks the snapshot list and the series' change rows side by side, so
+    memory stays constant however long the history is.
+    """
+    name_col, value_cols = SERIES_TABLES[table]
+    value_col = value_col or value_cols[0]
+    if end_timestamp is None:
+        end_timestamp = 2 ** 62
+    # Without the hint the planner prefers a primary-key range scan over every series.
+    initial = conn.execute(f'''
+        SELECT {value_col}, {absent_condition(table)} FROM {table} INDEXED BY idx_{table}_series
+        WHERE profile_id = ? AND member_uuid = ? AND {name_col} = ? AND snapshot_timestamp < ?
+        ORDER BY snapshot_timestamp DESC LIMIT 1
+    ''', (member[0], member[1], name, start_timestamp)).fetchone()
+    snapshots = conn.execute('SELECT snapshot_timestamp FROM profile_snapshots WHERE profile_id = ? AND member_uuid = ? AND snapshot_timestamp BETWEEN ? AND ? ORDER BY snapshot_timestamp ASC',
+                             (member[0], member[1], start_timestamp, end_timestamp))
+    changes = iter(conn.execute(f'''
+        SELECT {value_col}, snapshot_timestamp, {absent_condition(table)} FROM {table} INDEXED BY idx_{table}_series
+        WHERE profile_id = ? AND member_uuid = ? AND {name_col} = ? AND snapshot_timestamp BETWEEN ? AND ?
+        ORDER BY snapshot_timestamp ASC
+    ''', (member[0], member[1], name, start_timestamp, end_timestamp)))
+    # forward_fill() for a single series, without the per-point dict.
+    has_value, value = initial is not None and not initial[1], initial[0] if initial else None
+    pending = next(changes, None)
+    for (snapshot_timestamp,) in snapshots:
+        while pending is not None and pending[1] <= snapshot_timestamp:
+            has_value, value = not pending[2], pending[0]
+            pending = next(changes, None)
+        if has_value:
+            yield snapshot_timestamp, value
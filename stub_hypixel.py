@@ -0,0 +1,144 @@
+# stub_hypixel.py
+
+import argparse
+import json
+import math
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from hypixel_client import HypixelClient, RateLimiter
+from synthetic_profiles import SyntheticPlayer
+
+# Local stand-in for the Hypixel /v2/skyblock/profile endpoint, so the
+# collector's fetch path (concurrency, rate limiting, 429 handling) can be
+# exercised without an API key. Profiles come from synthetic_profiles.py.
+#
+#   python stub_hypixel.py --port 8080   # then HYPIXEL_API_URL=http://127.0.0.1:8080
+#   python stub_hypixel.py --check       # runs the client against it, exits 1 on failure
+
+class StubState:
+    """What the stub answers with; shared by its handler threads."""
+
+    def __init__(self, rate_limit=None, rate_window=60, fail_with_429=0, retry_after=1):
+        self.lock = threading.Lock()
+        self.rate_limit = rate_limit # None: no RateLimit-* headers
+        self.rate_window = rate_window
+        self.fail_with_429 = fail_with_429 # the first N requests get a 429
+        self.retry_after = retry_after
+        self.requests = 0
+        self.window_started = time.monotonic()
+        self.window_requests = 0
+        self.max_window_requests = 0
+        self.players = {}
+
+    def player(self, profile_id):
+        with self.lock:
+            player = self.players.get(profile_id)
+            if player is None:
+                player = self.players[profile_id] = SyntheticPlayer(len(self.players))
+            return player
+
+class StubHandler(BaseHTTPRequestHandler):
+    state = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        profile_id = parse_qs(url.query).get('profile', [None])[0]
+        if url.path != '/v2/skyblock/profile' or not profile_id:
+            return self._send(404, {"success": False, "cause": "Not found"})
+        state = self.state
+        with state.lock:
+            state.requests += 1
+            now = time.monotonic()
+            if now - state.window_started >= state.rate_window:
+                state.window_started, state.window_requests = now, 0
+            state.window_requests += 1
+            state.max_window_requests = max(state.max_window_requests, state.window_requests)
+            headers = {}
+            if state.rate_limit is not None:
+                headers = {'RateLimit-Limit': state.rate_limit, 'RateLimit-Remaining': max(state.rate_limit - state.window_requests, 0),
+                           'RateLimit-Reset': max(math.ceil(state.rate_window - (now - state.window_started)), 0)}
+            if state.fail_with_429 > 0:
+                state.fail_with_429 -= 1
+                return self._send(429, {"success": False, "cause": "Key throttle"}, {'Retry-After': state.retry_after, **headers})
+        payload = state.player(profile_id).payload()
+        payload['profile_id'] = profile_id
+        self._send(200, {"success": True, "profile": payload}, headers)
+
+    def _send(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, str(value))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_stub(state, port=0):
+    """Serves `state` on 127.0.0.1 from a daemon thread. Returns (server, base URL)."""
+    handler = type('Handler', (StubHandler,), {'state': state})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+# --- Checks ---
+
+def _fetch(state, profile_ids, **client_args):
+    server, base_url = start_stub(state)
+    client = HypixelClient('stub-key', base_url=base_url, **client_args)
+    try:
+        started = time.monotonic()
+        profiles = client.fetch_profiles(profile_ids)
+        return profiles, time.monotonic() - started
+    finally:
+        client.close()
+        server.shutdown()
+
+def check_retry_after():
+    """A 429 with a short Retry-After (and no RateLimit-* headers) only pauses for that long."""
+    profiles, elapsed = _fetch(StubState(fail_with_429=1, retry_after=1), ['a', 'b', 'c'])
+    ok = all(profiles.values()) and elapsed < 5
+    return ok, f"3 profiles after one 429 with Retry-After: 1 in {elapsed:.1f}s"
+
+def check_rate_limit():
+    """The client never sends more than the server's RateLimit-Limit per window."""
+    state = StubState(rate_limit=10, rate_window=2)
+    profiles, elapsed = _fetch(state, [f"p{index}" for index in range(25)], max_workers=8, rate_limiter=RateLimiter(limit=10, window=2))
+    ok = all(profiles.values()) and state.max_window_requests <= 10
+    return ok, f"25 profiles at 10 per 2s window in {elapsed:.1f}s, at most {state.max_window_requests} per window"
+
+CHECKS = [check_retry_after, check_rate_limit]
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a local stand-in for the Hypixel profile API.")
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--rate-limit', type=int, default=None, help="send RateLimit-* headers for this many requests per window")
+    parser.add_argument('--rate-window', type=int, default=60)
+    parser.add_argument('--fail-with-429', type=int, default=0, help="answer the first N requests with a 429")
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--check', action='store_true', help="run the client checks against a stub and exit")
+    args = parser.parse_args()
+
+    if args.check:
+        failed = False
+        for check in CHECKS:
+            ok, message = check()
+            failed = failed or not ok
+            print(f"{'ok  ' if ok else 'FAIL'} {check.__name__}: {message}")
+        sys.exit(1 if failed else 0)
+    server, base_url = start_stub(StubState(args.rate_limit, args.rate_window, args.fail_with_429, args.retry_after), args.port)
+    print(f"Serving a stub Hypixel API at {base_url} (Ctrl+C to stop).")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+# synthetic_profiles.py
+
+import argparse
+import hashlib
+import random
+import time
+
+from skyblock_constants import BESTIARY_FAMILIES
+from tier_engine import COLLECTION_THRESHOLDS
+
+# Offline stand-in for the Hypixel API: deterministic players whose profile
+# payloads have the same shape as /v2/skyblock/profile and evolve the way
+# real ones do. Most snapshots only touch a few skills, collections and mobs,
+# and an idle player returns the same payload as last time.
+#
+#   python synthetic_profiles.py --db synthetic.db --players 5 --years 2
+
+SKILLS = ['FARMING', 'MINING', 'COMBAT', 'FORAGING', 'FISHING', 'ENCHANTING', 'ALCHEMY', 'TAMING', 'CARPENTRY', 'RUNECRAFTING', 'SOCIAL']
+SLAYERS = ['zombie', 'spider', 'wolf', 'enderman', 'blaze', 'vampire']
+SLAYER_XP = [5, 25, 100, 500, 1500] # per boss kill, tiers 1-5
+KILL_STATS = ['zombie', 'skeleton', 'spider', 'enderman', 'blaze', 'wolf', 'slime', 'magma_cube']
+# Member sections a player can switch off in their API settings.
+API_SECTIONS = ['experience', 'collection', 'bestiary']
+
+def _collection_names(count):
+    names = sorted(COLLECTION_THRESHOLDS) or ['WHEAT']
+    return [names[i] if i < len(names) else f"{names[i % len(names)]}_{i // len(names)}" for i in range(count)]
+
+def _mob_ids(count):
+    # Real ids carry a level suffix ('zombie_1', 'arachne_300'); '_'-terminated prefixes always do.
+    prefixes = [prefix.rstrip('_') for island in BESTIARY_FAMILIES.values() for prefixes in island['prefixes'].values() for prefix in prefixes]
+    levels = [1, 15, 50, 100, 300]
+    return [f"{prefixes[i % len(prefixes)]}_{levels[(i // len(prefixes)) % len(levels)]}" for i in range(count)]
+
+class SyntheticPlayer:
+    """One player's profile, advanced one collection interval at a time."""
+
+    def __init__(self, seed, collections=60, mobs=150, activity=0.6, gaps=0.0):
+        self.rng = random.Random(seed)
+        digest = hashlib.sha256(f"synthetic-{seed}".encode()).hexdigest()
+        self.member_uuid = digest[:32]
+        self.profile_id = f"{digest[32:40]}-{digest[40:44]}-{digest[44:48]}-{digest[48:52]}-{digest[52:64]}"
+        self.cute_name = self.rng.choice(['Apple', 'Banana', 'Blueberry', 'Coconut', 'Cucumber', 'Grapes', 'Kiwi', 'Lemon', 'Lime', 'Mango', 'Orange', 'Papaya', 'Pear', 'Pineapple', 'Pomegranate', 'Raspberry', 'Strawberry', 'Tomato', 'Watermelon', 'Zucchini'])
+        self.activity = activity
+        self.gaps = gaps # chance per interval that an API section is switched off or back on
+        self.hidden = set()
+        self.skills = {skill: self.rng.randint(0, 50000) for skill in SKILLS}
+        self.slayers = {slayer: [0] * 6 for slayer in SLAYERS} # xp, tier 1-5 boss kills
+        self.collections = {name: self.rng.randint(0, 500) for name in _collection_names(collections)}
+        self.mobs = {mob_id: self.rng.randint(0, 20) for mob_id in _mob_ids(mobs)}
+        self.kills = {name: 0 for name in KILL_STATS}
+        self.purse = float(self.rng.randint(0, 100000))
+        self.bank = float(self.rng.randint(0, 1000000))
+        self.deaths = 0
+        self.transactions = []
+        self.clock = 0
+
+    def advance(self, snapshot_timestamp):
+        """Plays one interval; idle intervals leave the payload unchanged."""
+        rng = self.rng
+        if self.gaps:
+            for section in API_SECTIONS:
+                if rng.random() < self.gaps:
+                    self.hidden ^= {section}
+        if rng.random() >= self.activity:
+            return
+        for skill in rng.sample(SKILLS, rng.randint(1, 3)):
+            self.skills[skill] += int(rng.lognormvariate(9, 1.2))
+        for name in rng.sample(list(self.collections), min(len(self.collections), rng.randint(2, 8))):
+            self.collections[name] += int(rng.lognormvariate(6, 1.5))
+        for mob_id in rng.sample(list(self.mobs), min(len(self.mobs), rng.randint(3, 20))):
+            gained = int(rng.lognormvariate(3, 1))
+            self.mobs[mob_id] += gained
+            self.kills[rng.choice(KILL_STATS)] += gained
+        if rng.random() < 0.3:
+            slayer = self.slayers[rng.choice(SLAYERS)]
+            tier = rng.randint(1, 5)
+            boss_kills = rng.randint(1, 10)
+            slayer[tier] += boss_kills
+            slayer[0] += boss_kills * SLAYER_XP[tier - 1]
+        self.deaths += rng.randint(0, 3)
+        self.purse = max(0.0, self.purse + rng.gauss(20000, 40000))
+        if rng.random() < 0.2:
+            amount = round(rng.uniform(1000, 200000), 1)
+            action = rng.choice(['DEPOSIT', 'WITHDRAW'])
+            self.bank = max(0.0, self.bank + (amount if action == 'DEPOSIT' else -amount))
+            self.transactions = (self.transactions + [{"amount": amount, "timestamp": snapshot_timestamp * 1000 + self.clock, "action": action, "initiator_name": "§bPlayer"}])[-10:]
+            self.clock += 1
+
+    def payload(self):
+        """The profile as the API returns it (the "profile" field)."""
+        payload = {
+            "profile_id": self.profile_id,
+            "cute_name": self.cute_name,
+            "banking": {"balance": self.bank, "transactions": list(self.transactions)},
+            "members": {self.member_uuid: {
+                "currencies": {"coin_purse": self.purse},
+                "death_count": self.deaths,
+                "player_stats": {"kills": dict(self.kills)},
+                "experience": {f"SKILL_{skill}": float(xp) for skill, xp in self.skills.items()},
+                "slayer": {"slayer_bosses": {
+                    slayer: ({"xp": values[0], **{f"boss_kills_tier_{tier}": values[tier + 1] for tier in range(5) if values[tier + 1]}} if values[0] else {})
+                    for slayer, values in self.slayers.items()}},
+                "collection": dict(self.collections),
+                "bestiary": {"kills": dict(self.mobs)},
+            }},
+        }
+        for section in self.hidden:
+            del payload["members"][self.member_uuid][section]
+        return payload
+
+def generate_snapshots(players=5, years=1.0, interval=86400, start=None, seed=0, collections=60, mobs=150, activity=0.6, gaps=0.0):
+    """Yields (snapshot_timestamp, {profile_id: payload}, {profile_id: {member_uuid}}), oldest first."""
+    roster = [SyntheticPlayer(seed * 1000 + index, collections, mobs, activity, gaps) for index in range(players)]
+    tracked = {player.profile_id: {player.member_uuid} for player in roster}
+    count = max(1, int(years * 365 * 86400 // interval))
+    start = start if start is not None else int(time.time()) - count * interval
+    for step in range(count):
+        snapshot_timestamp = start + step * interval
+        for player in roster:
+            player.advance(snapshot_timestamp)
+        yield snapshot_timestamp, {player.profile_id: player.payload() for player in roster}, tracked
+
+def main():
+    # Imported here so the generator itself does not need the collector.
+    from db_schema import connect_database
+    from hypixel_tracker import create_database_schema, store_snapshot
+    from raw_archive import archive_response
+    from snapshot_store import load_series_state
+
+    parser = argparse.ArgumentParser(description="Fill a database with synthetic Skyblock snapshots.")
+    parser.add_argument('--db', default='synthetic.db')
+    parser.add_argument('--players', type=int, default=5)
+    parser.add_argument('--years', type=float, default=1.0)
+    parser.add_argument('--interval', type=int, default=86400, help="seconds between snapshots")
+    parser.add_argument('--collections', type=int, default=60)
+    parser.add_argument('--mobs', type=int, default=150)
+    parser.add_argument('--activity', type=float, default=0.6, help="chance a player plays during an interval")
+    parser.add_argument('--gaps', type=float, default=0.0, help="chance per interval that a player switches an API section off or back on")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--archive', default=None, help="also write the payloads to this raw archive directory")
+    args = parser.parse_args()
+
+    conn = connect_database(args.db)
+    create_database_schema(conn.cursor())
+    state = load_series_state(conn.cursor())
+    snapshots = 0
+    for snapshot_timestamp, fetched, tracked in generate_snapshots(args.players, args.years, args.interval, seed=args.seed,
+                                                                   collections=args.collections, mobs=args.mobs, activity=args.activity, gaps=args.gaps):
+        if args.archive:
+            for profile_id, data in fetched.items():
+                archive_response(profile_id, snapshot_timestamp, data, tracked[profile_id], args.archive)
+        store_snapshot(conn, fetched, tracked, snapshot_timestamp, state)
+        snapshots += 1
+    conn.close()
+    print(f"Wrote {snapshots} snapshot(s) of {args.players} player(s) to '{args.db}'.")
+
+if __name__ == '__main__':
+    main()
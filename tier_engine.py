@@ -0,0 +1,167 @@
+# tier_engine.py
+
+import json
+import os
+from bisect import bisect_right
+
+import numpy as np
+
+from skyblock_constants import SKILL_DATA, BESTIARY_THRESHOLDS, BESTIARY_FAMILIES
+
+# Everything here is compiled once at import time: the threshold arrays are
+# searched with bisect (one value) or padded into one matrix per family of
+# thresholds (a whole profile at once), and the bestiary family prefixes live
+# in a trie, so resolving a mob id costs O(len(id)) no matter how many
+# families exist.
+
+COLLECTIONS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'collections.json')
+
+def load_collection_data():
+    """Loads the collection thresholds from the collections.json file."""
+    try:
+        with open(COLLECTIONS_FILE, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        print("Warning: collections.json not found.")
+        return {}
+
+COLLECTION_THRESHOLDS = load_collection_data()
+
+# --- Levels and tiers ---
+
+def _tier(thresholds, value):
+    """Number of thresholds reached; thresholds are ascending."""
+    if not thresholds or value is None:
+        return 0
+    return bisect_right(thresholds, value)
+
+def calculate_level(skill_name, xp):
+    """Calculates skill level based on its name and total XP."""
+    return _tier(SKILL_DATA.get(skill_name, SKILL_DATA["standard"]), xp)
+
+def calculate_tier(collection_name, amount):
+    """Calculates collection tier based on its name and amount collected."""
+    return _tier(COLLECTION_THRESHOLDS.get(collection_name.upper()), amount)
+
+def threshold_matrix(thresholds):
+    """Pads a list of ascending threshold lists (or None) into one array, inf past the last tier."""
+    width = max((len(t) for t in thresholds if t), default=0) + 1
+    matrix = np.full((len(thresholds), width), np.inf)
+    for row, values in enumerate(thresholds):
+        if values:
+            matrix[row, :len(values)] = values
+    return matrix
+
+def next_thresholds(matrix, values):
+    """Returns (tier reached, next threshold or inf) for each row of `matrix`.
+
+    Counting the thresholds <= value is bisect_right for every row at once.
+    """
+    tiers = (matrix <= values[:, None]).sum(axis=1)
+    return tiers, matrix[np.arange(len(values)), tiers]
+
+# name -> row of the matrix; the last collection row (all inf) is for unknown names.
+_SKILL_ROWS = {name: row for row, name in enumerate(SKILL_DATA)}
+_SKILL_MATRIX = threshold_matrix(list(SKILL_DATA.values()))
+_COLLECTION_ROWS = {name: row for row, name in enumerate(COLLECTION_THRESHOLDS)}
+_COLLECTION_MATRIX = threshold_matrix(list(COLLECTION_THRESHOLDS.values()) + [None])
+
+def _tiers(matrix, rows, values):
+    # None becomes nan, which reaches no tier.
+    return next_thresholds(matrix[rows], np.array(list(values), dtype=np.float64))[0].tolist()
+
+def skill_levels(xp_by_skill):
+    """{skill: xp} -> {skill: level} for a whole profile."""
+    standard = _SKILL_ROWS["standard"]
+    rows = [_SKILL_ROWS.get(name, standard) for name in xp_by_skill]
+    return dict(zip(xp_by_skill, _tiers(_SKILL_MATRIX, rows, xp_by_skill.values())))
+
+def collection_tiers(amount_by_collection):
+    """{collection: amount} -> {collection: tier} for a whole profile."""
+    unknown = len(_COLLECTION_ROWS)
+    rows = [_COLLECTION_ROWS.get(name.upper(), unknown) for name in amount_by_collection]
+    return dict(zip(amount_by_collection, _tiers(_COLLECTION_MATRIX, rows, amount_by_collection.values())))
+
+# --- Bestiary families ---
+
+# A prefix matches a mob id that equals it or continues with '_' after it
+# ('zombie' matches 'zombie_1' but not 'zombies'), and the longest match wins.
+# A prefix written with a trailing '_' ('enderman_', 'blaze_') names a family
+# whose ids always carry a suffix: it is preferred over a bare prefix of the
+# same name ('enderman') when the id continues, and the bare prefix is
+# preferred when the id ends there. Because the collector strips level
+# suffixes before storing, a '_' prefix also matches its bare name when no
+# bare prefix claims it ('blaze').
+
+_TERMINAL = ''
+
+def _build_trie():
+    root = {}
+    families = []
+    for island, island_data in BESTIARY_FAMILIES.items():
+        bracket = island_data["bracket"]
+        for mob_name, prefixes in island_data["prefixes"].items():
+            family = len(families)
+            families.append((island, mob_name, bracket))
+            for prefix in prefixes:
+                node = root
+                for char in prefix.rstrip('_'):
+                    node = node.setdefault(char, {})
+                # terminal = [family of the bare prefix, family of the '_' prefix]
+                node.setdefault(_TERMINAL, [None, None])[prefix.endswith('_')] = family
+    return root, families
+
+_PREFIX_TRIE, FAMILIES = _build_trie()
+
+def resolve_family(mob_id):
+    """Returns the index into FAMILIES of the family owning `mob_id`, or None."""
+    node = _PREFIX_TRIE
+    match = None
+    length = len(mob_id)
+    for position, char in enumerate(mob_id):
+        node = node.get(char)
+        if node is None:
+            break
+        terminal = node.get(_TERMINAL)
+        if terminal is None:
+            continue
+        bare, suffixed = terminal
+        if position + 1 == length:
+            match = bare if bare is not None else suffixed
+        elif mob_id[position + 1] == '_':
+            match = suffixed if suffixed is not None else bare
+    return match
+
+def bestiary_tier(bracket, kills):
+    """Tier reached with `kills` in a bracket, plus the kills needed for the next one (None at max)."""
+    thresholds = BESTIARY_THRESHOLDS[bracket]
+    tier = _tier(thresholds, kills)
+    return tier, (thresholds[tier] if tier < len(thresholds) else None)
+
+def bestiary_families(kills_by_mob):
+    """Groups {mob_id: kills} into families and computes their tiers.
+
+    Returns ({family index: {"kills", "tier", "max_tier", "next_tier_kills", "mob_ids"}},
+    [mob ids that belong to no family]).
+    """
+    totals, members, unmatched = {}, {}, []
+    for mob_id, kills in kills_by_mob.items():
+        family = resolve_family(mob_id)
+        if family is None:
+            unmatched.append(mob_id)
+            continue
+        totals[family] = totals.get(family, 0) + (kills or 0)
+        members.setdefault(family, []).append(mob_id)
+
+    result = {}
+    for family, kills in totals.items():
+        bracket = FAMILIES[family][2]
+        tier, next_tier_kills = bestiary_tier(bracket, kills)
+        result[family] = {
+            "kills": kills,
+            "tier": tier,
+            "max_tier": len(BESTIARY_THRESHOLDS[bracket]),
+            "next_tier_kills": next_tier_kills,
+            "mob_ids": sorted(members[family]),
+        }
+    return result, sorted(unmatched)